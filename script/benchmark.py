@@ -0,0 +1,227 @@
+import os
+import sys
+import json
+import time
+import random
+import argparse
+import tempfile
+import tracemalloc
+import importlib.util
+import numpy as np
+
+
+def loadScript(fileName):
+    '''Imports one of the scripts next to this file, the hw*.py names can not be imported with import.
+
+    Returns:
+        the module
+    '''
+    path = os.path.join(os.path.dirname(os.path.abspath(__file__)), fileName)
+    spec = importlib.util.spec_from_file_location(fileName[:-3].replace('-', '_'), path)
+    module = importlib.util.module_from_spec(spec)
+    spec.loader.exec_module(module)
+    return module
+
+
+class Benchmark(object):
+    '''Times the kmer, graph and HMM entry points on synthetic inputs.
+
+    Attributes:
+        genomeLen -- length of the random genome (default 100000)
+        maxMotif -- maxMotif of MotifSearch (default 8)
+        kmerLen -- kmer length of the de Bruijn graph (default 12)
+        numStates -- number of HMM states (default 4)
+        seqLen -- length of the HMM observation, the Viterbi and forward-backward paths are log-space or scaled
+                  so it can be long enough for the timing to measure the per symbol work (default 100000)
+        dagNodes -- number of nodes of the random DAG (default 300)
+        repeat -- number of timed runs, the fastest is reported (default 3)
+        seed -- random seed of the synthetic inputs (default 0)
+    Methods:
+        randomSequence -- a random sequence
+        randomHmm -- a random HMM in the dict of dict format of the problem scripts
+        randomDag -- a random edge weighted DAG in the DagPath format
+        cases -- the benchmark cases
+        measure -- times one case and measures its peak memory
+        run -- runs the cases and returns the report
+    '''
+    def __init__(self, genomeLen=100000, maxMotif=8, kmerLen=12, numStates=4, seqLen=100000, dagNodes=300, repeat=3, seed=0):
+        self.genomeLen = genomeLen
+        self.maxMotif = maxMotif
+        self.kmerLen = kmerLen
+        self.numStates = numStates
+        self.seqLen = seqLen
+        self.dagNodes = dagNodes
+        self.repeat = repeat
+        self.seed = seed
+        self.rng = np.random.default_rng(seed)
+
+    def randomSequence(self, length, alphabet="ACGT"):
+        '''Draws a random sequence.
+
+        Returns:
+            a string of length characters from alphabet
+        '''
+        codes = self.rng.integers(len(alphabet), size=length)
+        return np.frombuffer(alphabet.encode(), dtype=np.uint8)[codes].tobytes().decode()
+
+    def randomHmm(self, alphabet="xyz"):
+        '''Draws a random HMM and an observation of seqLen symbols.
+
+        Returns:
+            states, observedChar, transition and emission dict of dicts, observation
+        '''
+        states = ['S%d' % state for state in range(self.numStates)] if self.numStates > 26 else [chr(ord('A') + state) for state in range(self.numStates)]
+        observedChar = list(alphabet)
+        transition = self.rng.random((self.numStates, self.numStates)) + 0.1
+        transition /= transition.sum(axis=1, keepdims=True)
+        emission = self.rng.random((self.numStates, len(observedChar))) + 0.1
+        emission /= emission.sum(axis=1, keepdims=True)
+        transitionDic = {state: {nextState: transition[i][j] for j, nextState in enumerate(states)} for i, state in enumerate(states)}
+        emissionDic = {state: {char: emission[i][j] for j, char in enumerate(observedChar)} for i, state in enumerate(states)}
+        observation = self.randomSequence(self.seqLen, alphabet)
+        return states, observedChar, transitionDic, emissionDic, observation
+
+    def randomDag(self):
+        '''Draws a random DAG with a path from node 0 to the last node.
+
+        Returns:
+            the setDic of DagPath, {(node, nextNode): weight}, with about 4 edges per node
+        '''
+        random.seed(self.seed)
+        setDic = {}
+        for node in range(self.dagNodes - 1):
+            setDic[(node, node + 1)] = random.randint(0, 20)  # the backbone keeps the sink reachable
+            for edge in range(3):
+                nextNode = random.randint(node + 1, self.dagNodes - 1)
+                setDic[(node, nextNode)] = random.randint(0, 20)
+        return setDic
+
+    def cases(self, workDir):
+        '''Builds the benchmark cases.
+
+        Each setup prepares fresh inputs (not timed) and returns the call that is timed.
+        Arguments:
+            workDir -- directory for the synthetic input files
+        Returns:
+            a list of (name, number of items processed per call, unit, setup)
+        '''
+        genome = self.randomSequence(self.genomeLen)
+        fastaPath = os.path.join(workDir, 'genome.fa')
+        with open(fastaPath, 'w') as fileH:
+            fileH.write('>synthetic\n')
+            for start in range(0, len(genome), 60):
+                fileH.write(genome[start:start + 60] + '\n')
+        states, observedChar, transition, emission, observation = self.randomHmm()
+        setDic = self.randomDag()
+
+        missingMotif = loadScript('missingMotif.py')
+        hw44 = loadScript('hw4-4.py')
+        compactBruijn = loadScript('compactBruijn.py')
+        hw46 = loadScript('hw4-6.py')
+        hwDag = loadScript('hw6-dag.py')
+        problem18 = loadScript('problem18.py')
+        problem25 = loadScript('problem25.py')
+        problem26 = loadScript('problem26.py')
+
+        def kmerCount():
+            return missingMotif.MotifSearch(fastaPath, 3, self.maxMotif).kmerCount
+
+        def nodesDic():
+            return hw44.BruijnConstruct(inputSequence=genome, edgeSize=self.kmerLen).nodesDic
+
+        def compactGraph():
+            return lambda: compactBruijn.CompactBruijn.fromSequence(genome, self.kmerLen)
+
+        def eulerianPath():
+            dic = hw44.BruijnConstruct(inputSequence=genome, edgeSize=self.kmerLen).nodesDic()
+            return hw46.EulerianPath(nodesDic=dic).eulerianPath
+
+        def longestPath():
+            return hwDag.DagPath(source=0, sink=self.dagNodes - 1, setDic=setDic).longestPath
+
+        def viterbiPath():
+            return problem18.ViterbiPath(observation=observation, transition=transition, emission=emission, states=states, observedChar=observedChar).viterbiPath
+
+        def scaledForwardBackward():
+            return problem25.SoftDecoding(observation=observation, transition=transition, emission=emission, states=states, observedChar=observedChar).scaledForwardBackward
+
+        def expectedCountsAndMStep():
+            # the expected counts from the forward and backward matrices, then their normalisation,
+            # the forward-backward itself runs in the untimed setup
+            decoding = problem25.SoftDecoding(observation=observation, transition=transition, emission=emission, states=states, observedChar=observedChar)
+            forward, backward, scale, logLikelihood = decoding.scaledForwardBackward()
+            return problem26.BaumWelch(forwardMatrix=forward, backwardMatrix=backward, states=states, observation=observation,
+                                       transition=transition, emission=emission, nodeRes=None, observedChar=observedChar, scale=scale).redefineParameters
+
+        numEdges = self.genomeLen - self.kmerLen + 1
+        return [('MotifSearch.kmerCount', self.genomeLen, 'bases', kmerCount),
+                ('BruijnConstruct.nodesDic', self.genomeLen, 'bases', nodesDic),
+                ('CompactBruijn.fromSequence', self.genomeLen, 'bases', compactGraph),
+                ('EulerianPath.eulerianPath', numEdges, 'edges', eulerianPath),
+                ('DagPath.longestPath', len(setDic), 'edges', longestPath),
+                ('ViterbiPath.viterbiPath', self.seqLen, 'symbols', viterbiPath),
+                ('SoftDecoding.scaledForwardBackward', self.seqLen, 'symbols', scaledForwardBackward),
+                ('BaumWelch.expectedCountsAndMStep', self.seqLen, 'symbols', expectedCountsAndMStep)]
+
+    def measure(self, items, unit, setup):
+        '''Times a case, then runs it once more under tracemalloc for its peak memory.
+
+        Returns:
+            a dict with the fastest time, the throughput and the peak memory
+        '''
+        times = []
+        for run in range(self.repeat):
+            call = setup()
+            start = time.perf_counter()
+            call()
+            times.append(time.perf_counter() - start)
+        call = setup()
+        tracemalloc.start()
+        call()
+        current, peak = tracemalloc.get_traced_memory()
+        tracemalloc.stop()
+        seconds = min(times)
+        return {'seconds': seconds,
+                'items': items,
+                'unit': unit,
+                'throughput': items / seconds if seconds > 0 else None,
+                'peakBytes': peak}
+
+    def run(self, only=None):
+        '''Runs the benchmark cases.
+
+        Arguments:
+            only -- a list of case names to run (default None, all of them)
+        Returns:
+            the report as a dict
+        '''
+        results = {}
+        with tempfile.TemporaryDirectory() as workDir:
+            for name, items, unit, setup in self.cases(workDir):
+                if only and name not in only:
+                    continue
+                results[name] = self.measure(items, unit, setup)
+        parameters = {'genomeLen': self.genomeLen, 'maxMotif': self.maxMotif, 'kmerLen': self.kmerLen,
+                      'numStates': self.numStates, 'seqLen': self.seqLen, 'dagNodes': self.dagNodes,
+                      'repeat': self.repeat, 'seed': self.seed}
+        return {'parameters': parameters, 'results': results}
+
+
+def main():
+    '''Runs the benchmark and writes the JSON report to STDOUT'''
+    parser = argparse.ArgumentParser(description="benchmark of the kmer, graph and HMM hot paths")
+    parser.add_argument('-g', '--genomeLen', type=int, default=100000, help='length of the random genome')
+    parser.add_argument('-max', '--maxMotif', type=int, default=8, help='maxMotif of MotifSearch')
+    parser.add_argument('-k', '--kmerLen', type=int, default=12, help='kmer length of the de Bruijn graph')
+    parser.add_argument('-s', '--numStates', type=int, default=4, help='number of HMM states')
+    parser.add_argument('-n', '--seqLen', type=int, default=100000, help='length of the HMM observation')
+    parser.add_argument('-d', '--dagNodes', type=int, default=300, help='number of nodes of the random DAG')
+    parser.add_argument('-r', '--repeat', type=int, default=3, help='number of timed runs, the fastest is reported')
+    parser.add_argument('--seed', type=int, default=0, help='random seed of the synthetic inputs')
+    parser.add_argument('--only', nargs='*', default=None, help='case names to run, ex MotifSearch.kmerCount')
+    args = parser.parse_args()
+    b = Benchmark(args.genomeLen, args.maxMotif, args.kmerLen, args.numStates, args.seqLen, args.dagNodes, args.repeat, args.seed)
+    sys.stdout.write(json.dumps(b.run(args.only), indent=2) + '\n')
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,431 @@
+import sys
+import argparse
+import numpy as np
+
+
+class CompactBruijn(object):
+    '''De Bruijn graph of k-mers with the (k-1)-mer nodes packed as 2-bit integers (A=0, C=1, G=2, T=3)
+    and the adjacency list stored in compressed sparse row arrays.
+
+    The graph is built by sorting the encoded k-mers: the nodes are the sorted unique prefix and suffix
+    codes, and the edges are the k-mers stably sorted by prefix, so the successors of a node keep the
+    order of the k-mers in the input. k-mers with a character other than ACGT are skipped.
+
+    Attributes:
+        kmerLen -- the k-mer (edge) length, at most 32
+        nodes -- sorted uint64 codes of the (k-1)-mer nodes
+        offsets -- the successors of node i are targets[offsets[i]:offsets[i + 1]]
+        targets -- node indices of the edge ends
+    Methods:
+        encode -- 2-bit codes of a sequence
+        kmerCodes -- packed codes of the k-mers of an encoded sequence
+        fromCodes -- builds the graph from packed k-mer codes
+        fromSequence -- builds the graph of the k-mers of a sequence
+        fromKmers -- builds the graph of a list of k-mers
+        nodeIndex -- the index of a node string
+        nodeString -- the string of a node index
+        successors -- the successor node indices of a node
+        degrees -- in and out degree of every node
+        nodesDic -- the graph as a dict of node string: successor strings
+        output -- STDOUT the Rosalind adjacency list
+        unitigs -- the maximal non-branching paths
+        contigs -- the strings spelled by the unitigs
+        unitigGraph -- the graph of the unitigs
+    '''
+    codeTable = np.full(256, 4, dtype=np.uint8)  # 4 marks a character that is not ACGT
+    codeTable[np.frombuffer(b'ACGTacgt', dtype=np.uint8)] = [0, 1, 2, 3, 0, 1, 2, 3]
+    letters = np.frombuffer(b'ACGT', dtype=np.uint8)
+
+    def __init__(self, kmerLen, nodes, offsets, targets):
+        self.kmerLen = kmerLen
+        self.nodes = nodes
+        self.offsets = offsets
+        self.targets = targets
+
+    @classmethod
+    def encode(cls, sequence):
+        '''Encodes a sequence.
+
+        Returns:
+            uint8 array of 2-bit codes, 4 for a character that is not ACGT
+        '''
+        return cls.codeTable[np.frombuffer(sequence.encode(), dtype=np.uint8)]
+
+    @staticmethod
+    def kmerCodes(encoded, kmerLen):
+        '''Packs every k-mer of an encoded sequence, the first base in the highest bits.
+
+        Returns:
+            uint64 array of the codes of the k-mers without an invalid character
+        '''
+        numKmers = len(encoded) - kmerLen + 1
+        if numKmers <= 0:
+            return np.zeros(0, dtype=np.uint64)
+        codes = np.zeros(numKmers, dtype=np.uint64)
+        for offset in range(kmerLen):
+            codes <<= np.uint64(2)
+            codes |= encoded[offset:offset + numKmers]
+        invalid = np.concatenate(([0], np.cumsum(encoded > 3)))
+        valid = invalid[kmerLen:] == invalid[:numKmers]  # no invalid character in the window
+        return codes[valid]
+
+    @classmethod
+    def fromCodes(cls, codes, kmerLen):
+        '''Builds the graph from packed k-mer codes.
+
+        Returns:
+            a CompactBruijn
+        '''
+        if not 2 <= kmerLen <= 32:
+            raise ValueError('kmerLen must be between 2 and 32')
+        prefixes = codes >> np.uint64(2)
+        suffixes = codes & np.uint64((1 << 2 * (kmerLen - 1)) - 1)
+        nodes = np.concatenate((prefixes, suffixes))
+        nodes.sort()
+        distinct = np.ones(len(nodes), dtype=bool)
+        np.not_equal(nodes[1:], nodes[:-1], out=distinct[1:])
+        nodes = nodes[distinct]
+        del distinct
+
+        order = np.argsort(prefixes, kind='stable')
+        indexType = np.int32 if len(nodes) < 2 ** 31 else np.int64
+        sources = np.searchsorted(nodes, prefixes[order]).astype(indexType)
+        del prefixes
+        targets = np.searchsorted(nodes, suffixes[order]).astype(indexType)
+        del suffixes, order
+        offsets = np.zeros(len(nodes) + 1, dtype=np.int32 if len(targets) < 2 ** 31 else np.int64)
+        np.cumsum(np.bincount(sources, minlength=len(nodes)), out=offsets[1:])
+        return cls(kmerLen, nodes, offsets, targets)
+
+    @classmethod
+    def fromSequence(cls, sequence, kmerLen):
+        '''Builds the graph of the k-mers of a sequence.
+
+        Returns:
+            a CompactBruijn
+        '''
+        return cls.fromCodes(cls.kmerCodes(cls.encode(sequence), kmerLen), kmerLen)
+
+    @classmethod
+    def fromKmers(cls, kmers, kmerLen):
+        '''Builds the graph of a list of k-mers, each k-mer is an edge.
+
+        Returns:
+            a CompactBruijn
+        '''
+        encoded = cls.encode(''.join(kmers)).reshape(len(kmers), kmerLen)
+        codes = np.zeros(len(kmers), dtype=np.uint64)
+        for offset in range(kmerLen):
+            codes <<= np.uint64(2)
+            codes |= encoded[:, offset]
+        return cls.fromCodes(codes[(encoded <= 3).all(axis=1)], kmerLen)
+
+    def nodeIndex(self, node):
+        '''The index of a node string.
+
+        Returns:
+            the node index, -1 if the node is not in the graph
+        '''
+        code = self.kmerCodes(self.encode(node), len(node))
+        if len(node) != self.kmerLen - 1 or len(code) == 0:
+            return -1
+        index = int(np.searchsorted(self.nodes, code[0]))
+        return index if index < len(self.nodes) and self.nodes[index] == code[0] else -1
+
+    def nodeString(self, index):
+        '''The string of a node index.
+
+        Returns:
+            the (k-1)-mer
+        '''
+        code = int(self.nodes[index])
+        shifts = 2 * np.arange(self.kmerLen - 2, -1, -1)
+        return self.letters[(code >> shifts) & 3].tobytes().decode()
+
+    def successors(self, index):
+        '''The successors of a node, in input order.
+
+        Returns:
+            array of node indices
+        '''
+        return self.targets[self.offsets[index]:self.offsets[index + 1]]
+
+    def degrees(self):
+        '''The in and out degree of every node.
+
+        Returns:
+            inDegree, outDegree arrays
+        '''
+        return np.bincount(self.targets, minlength=len(self.nodes)), np.diff(self.offsets)
+
+    def nodesDic(self):
+        '''The graph in the dict format of BruijnConstruct, nodes with successors only.
+
+        Returns:
+            a dict of node string: list of successor strings
+        '''
+        names = [self.nodeString(index) for index in range(len(self.nodes))]
+        return {names[index]: [names[target] for target in self.successors(index).tolist()]
+                for index in np.flatnonzero(np.diff(self.offsets)).tolist()}
+
+    def output(self, outFile=sys.stdout):
+        '''Rosalind output in an adjacency list format.'''
+        for key, value in self.nodesDic().items():
+            outFile.write(key + " -> " + ','.join(value) + "\n")
+
+    def unitigs(self):
+        '''Finds the maximal non-branching paths in one pass over the edges. A path starts at every edge
+        leaving a node that is not 1-in-1-out and extends through 1-in-1-out nodes, and the 1-in-1-out
+        nodes left over form isolated cycles, each reported once from its lowest node.
+
+        Returns:
+            bounds, path -- the node indices of unitig i are path[bounds[i]:bounds[i + 1]]
+        '''
+        inDegree, outDegree = self.degrees()
+        oneInOneOut = (inDegree == 1) & (outDegree == 1)
+        offsets, targets, simple = self.offsets.tolist(), self.targets.tolist(), oneInOneOut.tolist()
+        visited = bytearray(len(self.nodes))
+        path, bounds = [], [0]
+        for node in np.flatnonzero(~oneInOneOut & (outDegree > 0)).tolist():
+            for edge in range(offsets[node], offsets[node + 1]):
+                path.append(node)
+                nextNode = targets[edge]
+                while simple[nextNode]:
+                    visited[nextNode] = 1
+                    path.append(nextNode)
+                    nextNode = targets[offsets[nextNode]]
+                path.append(nextNode)
+                bounds.append(len(path))
+        for node in np.flatnonzero(oneInOneOut).tolist():
+            if visited[node]:
+                continue
+            nextNode = node
+            while True:
+                visited[nextNode] = 1
+                path.append(nextNode)
+                nextNode = targets[offsets[nextNode]]
+                if nextNode == node:
+                    break
+            path.append(node)
+            bounds.append(len(path))
+        return np.array(bounds, dtype=np.int64), np.array(path, dtype=self.targets.dtype)
+
+    def contigs(self):
+        '''Spells the unitigs, the first node followed by the last base of every other node.
+
+        Returns:
+            a list of contig strings
+        '''
+        bounds, path = self.unitigs()
+        lastBases = self.letters[(self.nodes[path] & np.uint64(3)).astype(np.intp)]
+        return [self.nodeString(path[start]) + lastBases[start + 1:end].tobytes().decode()
+                for start, end in zip(bounds[:-1].tolist(), bounds[1:].tolist())]
+
+    def unitigGraph(self):
+        '''The compacted graph, unitig i is followed by every unitig starting at the node where unitig i ends.
+
+        Returns:
+            bounds, path -- the unitigs
+            offsets, targets -- the unitigs following unitig i are targets[offsets[i]:offsets[i + 1]]
+        '''
+        bounds, path = self.unitigs()
+        first, last = path[bounds[:-1]], path[bounds[1:] - 1]
+        order = np.argsort(first, kind='stable')
+        low = np.searchsorted(first[order], last, side='left')
+        high = np.searchsorted(first[order], last, side='right')
+        offsets = np.zeros(len(first) + 1, dtype=np.int64)
+        np.cumsum(high - low, out=offsets[1:])
+        positions = np.arange(offsets[-1]) - np.repeat(offsets[:-1] - low, high - low)
+        return bounds, path, offsets, order[positions]
+
+
+class StreamingBruijn(object):
+    '''Builds a CompactBruijn from read files without keeping the reads, only the solid k-mers become edges.
+
+    The reads are streamed from FASTA or FASTQ and their k-mers are counted one batch at a time. The first
+    sighting of a k-mer only sets its bits in a Bloom filter, so the k-mers seen once, mostly sequencing
+    errors, never enter the count table. The k-mers seen again are kept as sorted unique codes with their
+    counts, the new codes of each batch wait in a pending list that is merged into the table once it is as
+    large as the table. A Bloom filter false positive counts a first sighting, so a count can be one too high.
+
+    Attributes:
+        kmerLen -- the k-mer (edge) length, at most 32
+        minCount -- the solidity threshold, k-mers seen fewer times are dropped (default 2)
+        filterBits -- size of the Bloom filter in bits, rounded up to a power of 2 (default 2 ** 27, 16 MB)
+        numHashes -- number of Bloom filter hashes (default 3)
+        batchSize -- number of bases counted together (default 2 ** 22)
+        codes -- sorted uint64 codes of the k-mers seen at least twice
+        counts -- uint32 number of sightings of each code
+    Methods:
+        readSequences -- the sequences of a FASTA or FASTQ file
+        filterHashes -- the Bloom filter bit positions of codes
+        countBatch -- counts the k-mers of a batch of encoded reads
+        mergePending -- merges the pending codes into the table
+        countSequences -- counts the k-mers of an iterable of reads
+        countFile -- counts the k-mers of a read file
+        solidKmers -- the codes and counts of the solid k-mers
+        graph -- the CompactBruijn of the solid k-mers
+    '''
+    hashMultipliers = np.array([0x9E3779B97F4A7C15, 0xC2B2AE3D27D4EB4F, 0x165667B19E3779F9, 0xD6E8FEB86659FD93,
+                                0xFF51AFD7ED558CCD, 0xC4CEB9FE1A85EC53, 0x94D049BB133111EB, 0xBF58476D1CE4E5B9], dtype=np.uint64)
+
+    def __init__(self, kmerLen, minCount=2, filterBits=1 << 27, numHashes=3, batchSize=1 << 22):
+        if not 2 <= kmerLen <= 32:
+            raise ValueError('kmerLen must be between 2 and 32')
+        if not 1 <= numHashes <= len(self.hashMultipliers):
+            raise ValueError('numHashes must be between 1 and %d' % len(self.hashMultipliers))
+        self.kmerLen = kmerLen
+        self.minCount = minCount
+        self.filterLog = max(3, (filterBits - 1).bit_length())
+        self.numHashes = numHashes
+        self.batchSize = batchSize
+        self.bloom = np.zeros(1 << (self.filterLog - 3), dtype=np.uint8) if minCount > 1 else None  # every k-mer is solid at 1
+        self.codes = np.zeros(0, dtype=np.uint64)
+        self.counts = np.zeros(0, dtype=np.uint32)
+        self.pending = []
+        self.pendingSize = 0
+
+    @staticmethod
+    def readSequences(fileName=''):
+        '''Reads the sequences of a FASTA or FASTQ file one record at a time, the format is told by the first
+        character ('>' FASTA, '@' FASTQ). FASTA records may span several lines, FASTQ records are the usual
+        four lines and their quality line is skipped.
+
+        Arguments:
+            fileName -- the read file (default '', STDIN)
+        Returns:
+            a generator of sequence strings
+        '''
+        fileH = open(fileName) if fileName else sys.stdin
+        try:
+            line = fileH.readline()
+            while line and not line.strip():  # skip leading blank lines
+                line = fileH.readline()
+            if line.startswith('@'):
+                while line:
+                    sequence = fileH.readline().strip()
+                    fileH.readline()  # the '+' line
+                    fileH.readline()  # the quality line
+                    yield sequence
+                    line = fileH.readline()
+                    while line and not line.strip():
+                        line = fileH.readline()
+            elif line.startswith('>'):
+                sequence = []
+                for line in fileH:
+                    if line.startswith('>'):
+                        yield ''.join(sequence)
+                        sequence = []
+                    else:
+                        sequence.append(line.strip())
+                yield ''.join(sequence)
+            elif line:
+                raise ValueError('the read file must be FASTA or FASTQ')
+        finally:
+            if fileH is not sys.stdin:
+                fileH.close()
+
+    def filterHashes(self, codes):
+        '''Multiplicative hashes of the codes, the top filterLog bits of code * multiplier.
+
+        Returns:
+            a (numHashes x codes) array of bit positions
+        '''
+        shift = np.uint64(64 - self.filterLog)
+        return np.stack([((codes * multiplier) >> shift).astype(np.intp)
+                         for multiplier in self.hashMultipliers[:self.numHashes]])
+
+    def countBatch(self, encoded):
+        '''Counts the k-mers of a batch of encoded reads, the reads are joined by an invalid code so no k-mer
+        spans two reads. The k-mers whose bits are not all set yet spend one sighting on setting them.'''
+        codes = CompactBruijn.kmerCodes(encoded, self.kmerLen)
+        if len(codes) == 0:
+            return
+        codes.sort()
+        starts = np.flatnonzero(np.concatenate(([True], codes[1:] != codes[:-1])))
+        counts = np.diff(np.append(starts, len(codes))).astype(np.uint32)
+        codes = codes[starts]
+        if self.bloom is not None:
+            positions = self.filterHashes(codes)
+            bytesIndex, masks = positions >> 3, (np.uint8(1) << (positions & 7).astype(np.uint8))
+            new = ((self.bloom[bytesIndex] & masks) == 0).any(axis=0)
+            np.bitwise_or.at(self.bloom, bytesIndex[:, new].ravel(), masks[:, new].ravel())
+            counts -= new.astype(np.uint32)  # the first sighting stays in the filter
+            seen = counts > 0
+            codes, counts = codes[seen], counts[seen]
+        self.pending.append((codes, counts))
+        self.pendingSize += len(codes)
+        if self.pendingSize >= max(len(self.codes), self.batchSize):
+            self.mergePending()
+
+    def mergePending(self):
+        '''Merges the pending codes into the table, adding the counts of equal codes.'''
+        if not self.pending:
+            return
+        codes = np.concatenate([self.codes] + [codes for codes, counts in self.pending])
+        counts = np.concatenate([self.counts] + [counts for codes, counts in self.pending])
+        self.pending, self.pendingSize = [], 0
+        order = np.argsort(codes, kind='stable')
+        codes, counts = codes[order], counts[order]
+        del order
+        starts = np.flatnonzero(np.concatenate(([True], codes[1:] != codes[:-1])))
+        self.codes = codes[starts]
+        self.counts = np.add.reduceat(counts, starts).astype(np.uint32) if len(starts) else counts
+
+    def countSequences(self, sequences):
+        '''Counts the k-mers of the reads, batchSize bases at a time.'''
+        batch, batchLen = [], 0
+        for sequence in sequences:
+            batch.append(sequence)
+            batchLen += len(sequence) + 1
+            if batchLen >= self.batchSize:
+                self.countBatch(CompactBruijn.encode('N'.join(batch)))
+                batch, batchLen = [], 0
+        if batch:
+            self.countBatch(CompactBruijn.encode('N'.join(batch)))
+
+    def countFile(self, fileName=''):
+        '''Counts the k-mers of a FASTA or FASTQ file.'''
+        self.countSequences(self.readSequences(fileName))
+
+    def solidKmers(self):
+        '''The k-mers seen at least minCount times, the table counts plus the first sighting kept in the filter.
+
+        Returns:
+            sorted uint64 codes, uint32 counts
+        '''
+        self.mergePending()
+        counts = self.counts + np.uint32(1) if self.bloom is not None else self.counts
+        solid = counts >= self.minCount
+        return self.codes[solid], counts[solid]
+
+    def graph(self):
+        '''Builds the graph of the solid k-mers, each distinct solid k-mer is one edge.
+
+        Returns:
+            a CompactBruijn, and the count of the k-mer of each edge in targets order
+        '''
+        codes, counts = self.solidKmers()
+        return CompactBruijn.fromCodes(codes, self.kmerLen), counts  # sorted codes keep their order in fromCodes
+
+
+def main():
+    '''Builds the de Bruijn graph of the solid k-mers of a read file and writes its adjacency list or contigs'''
+    parser = argparse.ArgumentParser(description="streaming de Bruijn graph of the solid k-mers of reads")
+    parser.add_argument('-i', '--inputFile', default='', help='the FASTA or FASTQ read file (default STDIN)')
+    parser.add_argument('-k', '--kmerLen', type=int, default=31, help='the k-mer (edge) length, at most 32')
+    parser.add_argument('-m', '--minCount', type=int, default=2, help='k-mers seen fewer times are dropped')
+    parser.add_argument('-f', '--filterBits', type=int, default=1 << 27, help='size of the Bloom filter in bits')
+    parser.add_argument('-c', '--contigs', action='store_true', help='write the contigs instead of the adjacency list')
+    args = parser.parse_args()
+    s = StreamingBruijn(args.kmerLen, args.minCount, args.filterBits)
+    s.countFile(args.inputFile)
+    graph, counts = s.graph()
+    if args.contigs:
+        for contig in graph.contigs():
+            sys.stdout.write(contig + '\n')
+    else:
+        graph.output()
+
+if __name__ == "__main__":
+    main()
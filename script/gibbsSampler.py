@@ -0,0 +1,115 @@
+import sys
+import argparse
+import numpy as np
+from fastaReader import FastAreader
+from randomizedMotif import RandomizedMotifSearch
+
+
+class GibbsSampler(RandomizedMotifSearch):
+    '''Returns a GibbsSampler object that finds a motif shared by a collection of sequences.
+
+    Each chain starts from random motifs and, at every iteration, resamples the motif of one
+    random sequence from the profile of the other motifs. Chains run through RandomizedMotifSearch.run,
+    so they are spread over worker processes the same way restarts are.
+    Attributes:
+        sequences -- list of sequences (ATCG)
+        motifLen -- the length of the motif
+        chains -- number of independent chains (default 20)
+        iterations -- maximum number of iterations of a chain (default 1000)
+        patience -- a chain stops after this many iterations without a better score (default 200)
+        pseudocount -- pseudocount added to every profile cell (default 1)
+        workers -- number of processes running chains (default 1)
+        seed -- base seed, chain i always uses the seed (seed, i) (default 0)
+    Methods:
+        oneHotMatrix -- one-hot encodes the sequences
+        windowProbabilities -- the probability of every window of one sequence under a profile
+        search -- runs one chain
+    '''
+    def __init__(self, sequences, motifLen, chains=20, iterations=1000, patience=200, pseudocount=1, workers=1, seed=0):
+        '''GibbsSampler constructor, encodes the sequences once.
+        '''
+        RandomizedMotifSearch.__init__(self, sequences, motifLen, chains, pseudocount, workers, seed)
+        self.iterations = iterations
+        self.patience = patience
+        self.oneHot = self.oneHotMatrix()
+
+    def oneHotMatrix(self):
+        '''One-hot encodes the sequences, padding and non ATCG characters are all zero.
+
+        Returns:
+            a float matrix of shape (number of sequences, longest sequence, 4)
+        '''
+        return (self.encoded[:, :, None] == np.arange(4)).astype(np.float64)
+
+    def windowProbabilities(self, row, profile):
+        '''Computes the probability of every window of one sequence under a profile.
+
+        Arguments:
+            row -- the index of the sequence
+            profile -- a (motifLen, 4) matrix of base probabilities
+        Returns:
+            an array with the probability of each window of the sequence
+        '''
+        numWindows = self.numWindows[row]
+        oneHot = self.oneHot[row]
+        probabilities = np.ones(numWindows)
+        for column in range(self.motifLen):
+            probabilities *= oneHot[column:column + numWindows] @ profile[column]
+        return probabilities
+
+    def search(self, chain):
+        '''Runs one Gibbs sampling chain.
+
+        The count matrix of the current motifs is kept up to date: swapping the motif of one
+        sequence only touches motifLen cells, and the score is read from the counts.
+        Arguments:
+            chain -- the chain number, it seeds the chain
+        Returns:
+            (score, positions) of the best motifs seen by the chain
+        '''
+        rng = np.random.default_rng([self.seed, chain])
+        numSequences = len(self.sequences)
+        columns = np.arange(self.motifLen)
+        positions = (rng.random(numSequences) * self.numWindows).astype(np.int64)
+        counts = self.countMatrix(positions)
+        bestScore = numSequences * self.motifLen - int(counts[:, :4].max(axis=1).sum())
+        bestPositions = positions.copy()
+        lastImprovement = 0
+        for iteration in range(1, self.iterations + 1):
+            row = rng.integers(numSequences)
+            counts[columns, self.encoded[row, positions[row] + columns]] -= 1  # hold the motif of this sequence out
+            profile = (counts[:, :4] + self.pseudocount) / (numSequences - 1 + 4 * self.pseudocount)
+            probabilities = self.windowProbabilities(row, profile)
+            total = probabilities.sum()
+            if total > 0:
+                drawn = np.searchsorted(np.cumsum(probabilities), rng.random() * total, side='right')
+                positions[row] = min(drawn, self.numWindows[row] - 1)  # guards against rounding in the cumulative sum
+            counts[columns, self.encoded[row, positions[row] + columns]] += 1
+            score = numSequences * self.motifLen - int(counts[:, :4].max(axis=1).sum())
+            if score < bestScore:
+                bestScore = score
+                bestPositions = positions.copy()
+                lastImprovement = iteration
+            elif iteration - lastImprovement >= self.patience:
+                break  # the score has plateaued
+        return bestScore, bestPositions
+
+
+def main():
+    '''Reads a fasta from STDIN, runs GibbsSampler and writes the best motifs to STDOUT'''
+    parser = argparse.ArgumentParser(description="Gibbs sampler motif search")
+    parser.add_argument('-k', '--motifLen', type=int, required=True, help='the motif length')
+    parser.add_argument('-c', '--chains', type=int, default=20, help='the number of chains')
+    parser.add_argument('-n', '--iterations', type=int, default=1000, help='the maximum number of iterations of a chain')
+    parser.add_argument('-pat', '--patience', type=int, default=200, help='stop a chain after this many iterations without improvement')
+    parser.add_argument('-p', '--pseudocount', type=float, default=1, help='the profile pseudocount')
+    parser.add_argument('-w', '--workers', type=int, default=1, help='number of processes running chains')
+    parser.add_argument('-s', '--seed', type=int, default=0, help='the random seed')
+    args = parser.parse_args()
+    sequences = [fastaSeq[1] for fastaSeq in FastAreader('').readFasta()]
+    m = GibbsSampler(sequences, args.motifLen, args.chains, args.iterations, args.patience, args.pseudocount, args.workers, args.seed)
+    score, motifs = m.run()
+    sys.stdout.write('\n'.join(motifs) + '\n')
+
+if __name__ == "__main__":
+    main()
@@ -8,12 +8,15 @@ class OverlapGraph(object):
 
     def __init__(self, kmers, kmerLen):
         '''Construct the overlap graph of a collection of k-mers.
+        Each k-mer is a node, so a repeated k-mer is a separate node, and a k-mer whose suffix is its own prefix has a self loop.
         Attributes:
             kmers - list of kmer compositions.
             kmerLen - the length of the kmer.
         Methodes:
             overlapTest - tests if two kmers have overlap.
-            edges - the overlap graph in the form of an adjacency list.'''
+            prefixIndex - indexes the kmers by their (k-1)-prefix.
+            edges - the overlap graph as a compressed adjacency list.
+            writeEdges - writes the edges in the Rosalind format.'''
         self.kmers = kmers
         self.kmerLen = kmerLen
 
@@ -23,17 +26,33 @@ class OverlapGraph(object):
         Returns - True if there is an overlap'''
         return firstKmer[-self.kmerLen + 1:] == secondKmer[:self.kmerLen -1]
 
+    def prefixIndex(self):
+        '''Indexes the kmers by their (k-1)-prefix.
+        Returns - a dict of prefix: list of the indices of the kmers starting with it'''
+        index = {}
+        for kmerIndex, kmer in enumerate(self.kmers):
+            index.setdefault(kmer[:self.kmerLen - 1], []).append(kmerIndex)
+        return index
+
     def edges(self):
-        '''Connects edges.
-        Return - Returns adjacency list of overlaped kmers.
+        '''Connects edges, looking up the suffix of each kmer in the prefix index, in O(kmers + edges).
+        Return - the adjacency list in compressed form, offsets and targets: the kmers following kmer i are
+                 kmers[targets[offsets[i]:offsets[i + 1]]].
         '''
-        for firstKmer, secondKmer in itertools.combinations(self.kmers, 2): #all possible combinations between keys and values
-            if self.overlapTest(firstKmer, secondKmer) == True:
-                sys.stdout.write(firstKmer + ' -> ' +  secondKmer + '\n')
-            elif self.overlapTest(secondKmer, firstKmer) == True:
-                sys.stdout.write(secondKmer+ ' -> '  + firstKmer + '\n')
-            else:
-                pass
+        index = self.prefixIndex()
+        neighbours = [index.get(kmer[len(kmer) - self.kmerLen + 1:], ()) for kmer in self.kmers] # the kmers whose prefix is this suffix
+        offsets = np.zeros(len(self.kmers) + 1, dtype=np.int64)
+        np.cumsum([len(kmerIndices) for kmerIndices in neighbours], out=offsets[1:])
+        targets = np.fromiter(itertools.chain.from_iterable(neighbours), dtype=np.int64, count=offsets[-1])
+        self.offsets, self.targets = offsets, targets
+        return offsets, targets
+
+    def writeEdges(self, outFile=sys.stdout):
+        '''Writes one line per edge, kmer -> kmer.'''
+        offsets, targets = self.edges()
+        for kmerIndex, kmer in enumerate(self.kmers):
+            for nextIndex in targets[offsets[kmerIndex]:offsets[kmerIndex + 1]].tolist():
+                outFile.write(kmer + ' -> ' + self.kmers[nextIndex] + '\n')
 
 def main():
     '''Processing the input stdin, creating required objects for OverlapGraph, and initiation OverlapGraph'''
@@ -44,7 +63,7 @@ def main():
     kmerLen = len(kmers[0]) # the kmer length
 
     m = OverlapGraph(kmers= kmers, kmerLen= kmerLen)
-    m.edges()
+    m.writeEdges()
 
 if __name__ == "__main__":
     main()
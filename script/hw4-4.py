@@ -2,6 +2,7 @@
 import numpy as np
 import sys
 from collections import defaultdict
+from compactBruijn import CompactBruijn
 
 
 class BruijnConstruct(object):
@@ -12,6 +13,7 @@ class BruijnConstruct(object):
     Methodes:
         stringSplit - split an edge into two nodes
         nodesDic - creates a dictionary of nodes
+        compactGraph - the graph with packed nodes and CSR adjacency
         output - stdout the Rosalind format'''
 
     def __init__(self, inputSequence, edgeSize):
@@ -42,6 +44,13 @@ class BruijnConstruct(object):
                 nodes[start].append(end)
         return nodes
 
+    def compactGraph(self):
+        '''The same graph as nodesDic with the nodes packed as 2-bit integers and the adjacency in CSR arrays,
+        a few bytes per edge instead of a Python string per edge.
+        Returns:
+            a CompactBruijn'''
+        return CompactBruijn.fromSequence(self.inputSequence, self.edgeSize)
+
     def output(self):
         '''Rosalind output in an adjacency list format.
         Returns:
@@ -3,6 +3,7 @@
 import numpy as np
 import sys
 from collections import defaultdict
+from compactBruijn import CompactBruijn
 
 class BruijnGraph(object):
     '''Construct the de Bruijn graph from a list of kmers.
@@ -11,6 +12,7 @@ class BruijnGraph(object):
         edgesList - the sequence
     Methodes:
         nodesDic - dict representation of the graph
+        compactGraph - the graph with packed nodes and CSR adjacency
         output - Rosalind output format'''
 
     def __init__(self, edgesList, edgeSize):
@@ -31,6 +33,13 @@ class BruijnGraph(object):
                 nodes[start].append(end)
         return nodes
 
+    def compactGraph(self):
+        '''The same graph as nodesDic with the nodes packed as 2-bit integers and the adjacency in CSR arrays,
+        a few bytes per edge instead of a Python string per edge.
+        Returns:
+            a CompactBruijn'''
+        return CompactBruijn.fromKmers(self.edgesList, self.edgeSize)
+
     def output(self):
         '''Rosalind output format.
         Returns:
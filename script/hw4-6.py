@@ -1,43 +1,52 @@
 #Q6
 import numpy as np
-import random
-from collections import defaultdict
+import itertools
+from collections import defaultdict, Counter
 import sys
 
 
 class EulerianPath(object):
     '''Finds an Eulerian path in a graph.
     Attributes:
-        nodesDic - a directed graph in dict format
+        nodesDic - a directed graph in dict format, it is not modified
         startNode - the start node if it exists
         lastNode - last node of it exists
     Methodes:
+        arrayGraph - the graph as node labels and compressed adjacency arrays
         edgesFreq - the difference between the input and output edges from all nodes.
         endNodes - finds the start and end nodes.
         edgesNum - finds the total number of edges
-        count - counts the number of outgoing edges given a node
+        eulerWalk - Hierholzer walk over compressed adjacency arrays
         eulerianPath - finds an Eulerian path
         outputFormat - Rosalind output format of the eulerianPath
-        connectEdges - connecting the end nodes with an edge
     '''
     def __init__(self, nodesDic):
         self.nodesDic = nodesDic
         self.startNode = []
         self.lastNode = []
 
+    def arrayGraph(self):
+        '''Numbers the nodes and stores the edges in compressed sparse row form, the edges of a node keep their order.
+        Returns:
+            nodes - array of the sorted node labels
+            offsets - the edges of node i are targets[offsets[i]:offsets[i + 1]]
+            targets - the node index at the end of each edge'''
+        keys = np.array(list(self.nodesDic.keys()))
+        outDegree = np.fromiter(map(len, self.nodesDic.values()), dtype=np.int64, count=len(keys))
+        ends = np.array(list(itertools.chain.from_iterable(self.nodesDic.values())))
+        nodes, inverse = np.unique(np.concatenate((keys, ends)), return_inverse=True)
+        sources = np.repeat(inverse[:len(keys)], outDegree)
+        order = np.argsort(sources, kind='stable')
+        offsets = np.zeros(len(nodes) + 1, dtype=np.int64)
+        np.cumsum(np.bincount(sources, minlength=len(nodes)), out=offsets[1:])
+        return nodes, offsets, inverse[len(keys):][order]
+
     def edgesFreq(self):
         '''Generates frequency dicts.
         Returns:
             two dicts'''
-        L = list()
-        inFreq = {} #a dictionary containg the frequency of input edges for all node
-        outFreq = defaultdict(int) #a dictionary containg the frequency of output edges for all node
-        for key,value in self.nodesDic.items():
-            valueLen = len(value)
-            inFreq[key] = valueLen
-            L = L + value
-        for i in L:
-            outFreq[i] += 1
+        inFreq = {key: len(value) for key, value in self.nodesDic.items()} #a dictionary containg the frequency of input edges for all node
+        outFreq = Counter(itertools.chain.from_iterable(self.nodesDic.values())) #a dictionary containg the frequency of output edges for all node
         inOut = {key: inFreq[key] - outFreq.get(key, 0) for key in inFreq.keys()} #difference betweein the number of outgouing edges and in goin edges
         outIn = {key: outFreq[key] - inFreq.get(key, 0) for key in outFreq.keys()} #difference betweein the number of ingoing edges and in outgoing edges
         return inOut, outIn
@@ -59,84 +68,83 @@ class EulerianPath(object):
         lastNode= self.lastNode
         return startNode, lastNode
 
-    def connectEdges(self):
-        '''Connecting end nodes if we do not have a cycle.
-        Returns:
-            modified dict withan extra edge'''
-        startNode,  lastNode = self.endNodes()
-        if startNode != []:
-            self.nodesDic[lastNode].append(startNode)
-
     def edgesNum(self):
         '''Count the total number of edges.
         Returns:
             the total number of edges'''
-        totalEdges = 0
-        for k,v in self.nodesDic.items():
-            totalEdges += len(v)
-        return totalEdges
+        return sum(len(v) for v in self.nodesDic.values())
 
-    def count(self,nodesDic,node): #countinf the number of untouched edges for a given node
-        '''Counts the number of edges from a node.
-        Argumnets:
-            nodesDic - a directed graph of nodes in dict format.
-            node - the value of the node
+    @staticmethod
+    def eulerWalk(offsets, targets, start):
+        '''Iterative Hierholzer walk, linear in the number of edges. Each node keeps a cursor to its next unused edge,
+        edges are used from the last one like list.pop, and the stack and path are allocated once.
+        Arguments:
+            offsets, targets - compressed adjacency arrays
+            start - the index of the start node
         Returns:
-            the number of remaind edges from that node
-            '''
-        remaindEdges = len(nodesDic[node])
-        return remaindEdges
+            the node indices of the walk, one more than the number of edges when every edge is reachable'''
+        first = offsets[:-1].tolist()
+        cursor = offsets[1:].tolist() # one past the next unused edge of each node
+        targets = targets.tolist()
+        stack = [0] * (len(targets) + 1) # the walking path
+        path = [0] * (len(targets) + 1) # the path that we are confident about, in reverse
+        stack[0] = start
+        top, pathLen = 1, 0
+        while top:
+            node = stack[top - 1]
+            if cursor[node] > first[node]: # an unused edge, walk along it
+                cursor[node] -= 1
+                stack[top] = targets[cursor[node]]
+                top += 1
+            else: # stuck, the node is final
+                top -= 1
+                path[pathLen] = node
+                pathLen += 1
+        return path[pathLen - 1::-1]
 
     #idea was taken from http://www.graph-magics.com/articles/euler.php
     #witten in collaboration with Julia Philipp
     def eulerianPath(self):
-        '''Finds a eulerian path.
+        '''Finds a eulerian path, starting at the node with one more outgoing than incoming edge,
+        or a eulerian cycle from the first node when every node is balanced.
         Returns:
-            a eulerian path in a list format.'''
-        self.connectEdges()
-        totalEdges = self.edgesNum() # finding the total number of edges
-        stack = [] # stack of the walking path
-        location = '' # current location
-        circuit = [] # the path that we are confident about
-        nodesDic = self.nodesDic # directed graph of nodes in the dict format
-        if self.startNode != []:
-            location = self.startNode
-        else:
-            location = random.choice(list(nodesDic.keys()))
-        while all(value == [] for value in self.nodesDic.values()) == False: # As long as any all edges have not been used
-            while self.count(nodesDic, location) != 0: # counts the number of edges coming out of this location, as long as it is not 0 ( meaning we have not made a loop)
-                stack.append(location) # give the location to the stack
-                newLocation = nodesDic[location].pop() # go to a new location
-                location = newLocation # set the new location to location
-            while self.count(nodesDic,location) == 0: #if we have made a loop
-                circuit.append(location) # append the location to circuit
-                if stack != []: #if the stack is not empty
-                    location = stack.pop() #pop from the stack, and put that as a new location
-                else:
-                    break
-        circuit = circuit[::-1] # reverse the list
-        return circuit
+            a eulerian path in a list format.
+        Raises:
+            ValueError - when a node other than the two ends is unbalanced, or some edges can not be reached from the start'''
+        if self.edgesNum() == 0:
+            return list(self.nodesDic.keys())[:1]
+        nodes, offsets, targets = self.arrayGraph()
+        nodes = nodes.tolist()
+        outDegree = np.diff(offsets)
+        inDegree = np.bincount(targets, minlength=len(nodes))
+        balance = outDegree - inDegree
+        # a path needs every node balanced, or one start (+1) and one end (-1), the balances always sum to 0
+        if np.abs(balance).sum() > 2:
+            raise ValueError('the graph is not balanced, it has no eulerian path')
+        starts = np.flatnonzero(balance == 1)
+        self.startNode = nodes[starts[0]] if len(starts) else []
+        ends = np.flatnonzero(balance == -1)
+        self.lastNode = nodes[ends[0]] if len(ends) else []
+        start = int(starts[0]) if len(starts) else int(np.flatnonzero(outDegree)[0])
+        walk = self.eulerWalk(offsets, targets, start)
+        if len(walk) != len(targets) + 1: # the walk is stuck before using every edge, the graph is disconnected
+            raise ValueError('the graph is not connected, it has no eulerian path')
+        return [nodes[node] for node in walk]
 
     def outputFormat(self):
         '''Rosaling stdout format.
         Returns:
             Rosaling stdout format'''
         c = self.eulerianPath()
-        if self.startNode != []:
-            del c[-1]
-        for i,j in enumerate(c):
-            if i == 0:
-                sys.stdout.write(str(j))
-            else:
-                sys.stdout.write('->' + str(j))
+        sys.stdout.write('->'.join(map(str, c)))
 
 def main():
     '''Preprocessing the input stdin file, create necessary attributes, initiate the class'''
     dic = defaultdict(list)
     for line in sys.stdin.readlines():
         tmp = line[:-1].split(" -> ")
-        k = np.int(tmp[0])
-        v = [np.int(i) for i in tmp[1].split(",")]
+        k = int(tmp[0])
+        v = [int(i) for i in tmp[1].split(",")]
         dic[k] += v
 
     d = EulerianPath(nodesDic= dic)
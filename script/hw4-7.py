@@ -1,7 +1,9 @@
 #Q5
 import numpy as np
 import sys
+import argparse
 from collections import defaultdict
+from compactBruijn import CompactBruijn
 
 class BruijnGraph(object):
     '''Construct the de Bruijn graph from a list of kmers.
@@ -170,10 +172,25 @@ class SequenceReconstruct(object):
         return s
 
 class StringReconstruction(object):
+    '''Reconstructs a string from its kmers.
+    Attributes:
+        inputSequence - a list of kmers
+        kmerLen - the kmer length
+    Methodes:
+        f - STDOUT the string spelled by an eulerian path of the de Bruijn graph
+        contigs - the contigs of the maximal non-branching paths of the de Bruijn graph
+    '''
     def __init__(self, inputSequence, kmerLen):
         self.inputSequence = inputSequence
         self.kmerLen = kmerLen
 
+    def contigs(self):
+        '''Compacts the de Bruijn graph of the kmers into unitigs, which also works when the graph branches.
+        Returns:
+            a list of contigs'''
+        graph = CompactBruijn.fromKmers(self.inputSequence, self.kmerLen)
+        return graph.contigs()
+
     def f(self):
         graph = BruijnGraph(edgeSize= self.kmerLen, inputSequence= self.inputSequence)
         dic = graph.nodesDic() # making a dictionary of nodes
@@ -185,6 +202,9 @@ class StringReconstruction(object):
 
 
 def main():
+    parser = argparse.ArgumentParser(description="string reconstruction from kmers, the kmer length and the kmers are read from STDIN")
+    parser.add_argument('-c', '--contigs', action='store_true', help='write the contigs of the maximal non-branching paths, one per line')
+    args = parser.parse_args()
     inputSequence = []
     kmerLen = ''
     for index, line in enumerate(sys.stdin):
@@ -196,7 +216,10 @@ def main():
 
 
     m = StringReconstruction(inputSequence = inputSequence, kmerLen = kmerLen)
-    m.f()
+    if args.contigs:
+        sys.stdout.write('\n'.join(m.contigs()) + '\n')
+    else:
+        m.f()
 
 
 if __name__ == "__main__":
@@ -6,6 +6,363 @@ import numpy as np
 from fastaReader import FastAreader
 import itertools
 import argparse
+import functools
+import collections
+import multiprocessing
+import hashlib
+import glob
+import os
+
+
+class KmerCounter(object):
+    '''Returns a KmerCounter object that counts kmers in flat count arrays.
+
+    Attributes:
+        maxMotif -- maximum motif size to count
+        canonical -- count both strands into canonical kmer bins (default False)
+        counts -- list of count arrays, counts[k] holds the counts of all 4**k kmers of length k,
+                  or of its tableSize(k) canonical bins when canonical; int64 up to length wideMotif and
+                  uint32 above, so the largest tables take 4 bytes per kmer
+        sequenceLen -- number of characters seen on the counted strands (includes the record separators)
+        tail -- the last maxMotif - 1 encoded bases of the current record
+    Methods:
+        encode -- converts a sequence to a 2-bit integer array
+        countType -- the dtype of the count array of a kmer length
+        addCodes -- adds one to the count of each of a list of bins
+        update -- adds every kmer of a sequence, or of the next chunk of a record, to the count arrays
+        endRecord -- closes the current record so no kmer spans it and the next one
+        updateBatch -- adds a list of consecutive chunks with one update
+        carryOver -- starts part way through a record whose preceding bases were counted elsewhere
+        merge -- adds the counts of another KmerCounter
+        save -- writes the count arrays to a binary index file
+        fromIndex -- opens an index file as memory-mapped count arrays
+        kmerCodes -- yields the rolling integer codes of a sequence for each kmer length
+        reverseComplement -- the codes of the reverse complements of kmer codes
+        tableSize -- the number of bins of a kmer length
+        canonicalBins -- the canonical bin of kmer codes
+        binCodes -- the canonical code of each canonical bin
+        lookup -- the counts of any kmer codes, canonical or not
+        fullCounts -- the counts of all 4**k kmers of a length
+        kmerString -- converts an integer code back to a kmer
+    '''
+    alphabet = "ACGT"  # sorted, so the code of a kmer is its rank in itertools.product order
+    codeTable = np.full(256, -1, dtype=np.int8)  # byte -> 2-bit code, -1 for non canonical nucleotides
+    codeTable[np.frombuffer(alphabet.encode(), dtype=np.uint8)] = np.arange(len(alphabet))
+    wideMotif = 8  # the tables of longer kmers are uint32, a kmer seen 2**32 times or more would wrap
+    # index file layout: magic, maxMotif, sequenceLen and canonical as int64, then counts[0..maxMotif]
+    # each in its countType
+    indexMagic = b'KMERIDX4'
+    indexHeader = len(indexMagic) + 3 * 8
+
+    def __init__(self, maxMotif=8, canonical=False):
+        '''KmerCounter constructor, initialize empty count arrays for kmers of length 1 through maxMotif.
+        '''
+        self.maxMotif = maxMotif
+        self.canonical = canonical
+        self.counts = [np.zeros(self.tableSize(kmerLen, canonical), dtype=self.countType(kmerLen)) for kmerLen in range(self.maxMotif + 1)]
+        self.sequenceLen = 0
+        self.tail = np.zeros(0, dtype=np.int8)
+
+    @staticmethod
+    def encode(sequence):
+        '''Encodes a sequence into 2-bit codes.
+
+        Arguments:
+            sequence -- a string
+        Returns:
+            an int8 array with A=0, C=1, G=2, T=3 and -1 for everything else
+        '''
+        raw = np.frombuffer(sequence.encode('ascii', 'replace'), dtype=np.uint8)
+        return KmerCounter.codeTable[raw]
+
+    def kmerCodes(self, encoded, overlap=0):
+        '''Rolls the kmer codes of an encoded sequence one kmer length at a time.
+
+        Arguments:
+            encoded -- an array returned by encode
+            overlap -- number of leading bases that were already counted, kmers that lie entirely in them are skipped
+        Returns:
+            yields (kmerLen, codes, reverse) where codes are the integer codes of every kmer that only has
+            canonical nucleotides and reverse the codes of their reverse complements (None unless canonical)
+        '''
+        valid = encoded >= 0
+        bases = np.where(valid, encoded, 0).astype(np.int64)
+        code = np.zeros(len(encoded), dtype=np.int64)
+        reverse = np.zeros(len(encoded), dtype=np.int64)
+        window = np.ones(len(encoded), dtype=bool)  # True if the kmer starting here has no separator in it
+        for kmerLen in range(1, self.maxMotif + 1):
+            numKmers = len(encoded) - kmerLen + 1
+            if numKmers <= 0:
+                break
+            code = code[:numKmers] * 4 + bases[kmerLen - 1:]  # shift the previous kmer left and add the next base
+            window = window[:numKmers] & valid[kmerLen - 1:]
+            first = max(0, overlap - kmerLen + 1)  # the first kmer that ends after the overlap
+            keep = window[first:]
+            if self.canonical:
+                # the complement of the next base becomes the first base of the reverse complement
+                reverse = reverse[:numKmers] + (3 - bases[kmerLen - 1:]) * 4 ** (kmerLen - 1)
+                yield kmerLen, code[first:][keep], reverse[first:][keep]
+            else:
+                yield kmerLen, code[first:][keep], None
+
+    @classmethod
+    def countType(cls, kmerLen):
+        '''The dtype of the count array of a kmer length.
+
+        Returns:
+            int64 for the small tables, uint32 for the tables of kmers longer than wideMotif
+        '''
+        return np.dtype(np.int64) if kmerLen <= cls.wideMotif else np.dtype(np.uint32)
+
+    def addCodes(self, kmerLen, bins):
+        '''Adds one to counts[kmerLen] at each bin, a bin can repeat.
+
+        A bincount is as long as the table, so it is only used when there are at least a quarter as
+        many bins as the table has; fewer bins are sorted and their run lengths added in place. Either
+        way the temporaries stay within a few times the size of bins.
+        Arguments:
+            kmerLen -- the kmer length
+            bins -- an integer array of indices into counts[kmerLen]
+        '''
+        table = self.counts[kmerLen]
+        if 4 * len(bins) >= len(table):
+            table += np.bincount(bins, minlength=len(table)).astype(table.dtype)
+        elif len(bins):
+            bins = np.sort(bins)
+            starts = np.flatnonzero(np.concatenate(([True], bins[1:] != bins[:-1])))
+            table[bins[starts]] += np.diff(np.append(starts, len(bins))).astype(table.dtype)
+
+    def update(self, sequence):
+        '''Adds every kmer of length 1 through maxMotif in a sequence to the count arrays.
+
+        Consecutive calls continue the same record: the kmers that span the end of the previous
+        chunk and the start of this one are counted, until endRecord is called.
+        Arguments:
+            sequence -- a string, kmers are never counted across a non ATCG character
+        '''
+        encoded = self.encode(sequence)
+        overlap = len(self.tail)
+        if overlap:
+            encoded = np.concatenate((self.tail, encoded))  # the tail carries kmers over the chunk boundary
+        for kmerLen, codes, reverse in self.kmerCodes(encoded, overlap):
+            if self.canonical:
+                # both strands in one pass: every kmer is binned with its reverse complement,
+                # and a palindrome is the same kmer on both strands so it is counted twice
+                bins = self.canonicalBins(codes, reverse, kmerLen)
+                self.addCodes(kmerLen, np.concatenate((bins, bins[codes == reverse])))
+            else:
+                self.addCodes(kmerLen, codes)
+        self.tail = encoded[max(0, len(encoded) - (self.maxMotif - 1)):].copy()
+        self.sequenceLen += len(sequence) * (2 if self.canonical else 1)
+
+    def endRecord(self):
+        '''Ends the current record, it is counted like the \n separator of MotifSearch.inputSeq.
+        '''
+        self.tail = self.tail[:0]
+        self.sequenceLen += 2 if self.canonical else 1
+
+    def updateBatch(self, chunks):
+        '''Adds consecutive chunks with a single update, a \n closes each record but the last as endRecord would.
+
+        Every update call bins each kmer length into a 4**k array, so small chunks and short records
+        are joined first instead of paying that per chunk.
+        Arguments:
+            chunks -- list of (chunk, endOfRecord) continuing the current record
+        '''
+        if not chunks:
+            return
+        joined = ''.join(chunk + '\n' if endOfRecord else chunk for chunk, endOfRecord in chunks[:-1])
+        self.update(joined + chunks[-1][0])
+        if chunks[-1][1]:
+            self.endRecord()
+
+    def carryOver(self, sequence):
+        '''Sets the bases preceding the next chunk, they are only used for kmers that span into the chunk.
+
+        Arguments:
+            sequence -- the last maxMotif - 1 bases (or fewer) before the next chunk of the record
+        '''
+        self.tail = self.encode(sequence)
+
+    def merge(self, other):
+        '''Adds the counts of another KmerCounter with the same maxMotif.
+
+        Returns:
+            self, so merges can be chained in a reduction
+        '''
+        if other.canonical != self.canonical:
+            raise ValueError('can not merge canonical and single strand counts')
+        for kmerLen in range(1, self.maxMotif + 1):
+            self.counts[kmerLen] += other.counts[kmerLen]
+        self.sequenceLen += other.sequenceLen
+        return self
+
+    def save(self, path):
+        '''Writes the count arrays to a binary index file that fromIndex can memory-map.
+
+        The file is written next to path and renamed, so a reader never sees half an index.
+        '''
+        tmpPath = path + '.tmp%d' % os.getpid()
+        with open(tmpPath, 'wb') as fileH:
+            fileH.write(self.indexMagic)
+            np.array([self.maxMotif, self.sequenceLen, self.canonical], dtype='<i8').tofile(fileH)
+            for kmerLen in range(self.maxMotif + 1):
+                np.asarray(self.counts[kmerLen], dtype=self.countType(kmerLen).newbyteorder('<')).tofile(fileH)
+        os.replace(tmpPath, path)
+
+    @classmethod
+    def fromIndex(cls, path, maxMotif=None):
+        '''Opens an index file written by save without copying the count arrays.
+
+        Arguments:
+            path -- the index file
+            maxMotif -- only expose kmers up to this length (default, everything in the index)
+        Returns:
+            a KmerCounter whose counts are read-only views of the memory-mapped file
+        '''
+        with open(path, 'rb') as fileH:
+            header = fileH.read(cls.indexHeader)
+        if header[:len(cls.indexMagic)] != cls.indexMagic:
+            raise ValueError('%s is not a kmer index' % path)
+        indexMax, sequenceLen, canonical = np.frombuffer(header, dtype='<i8', offset=len(cls.indexMagic)).tolist()
+        if maxMotif is None:
+            maxMotif = indexMax
+        if maxMotif > indexMax:
+            raise ValueError('%s only holds kmers up to length %d' % (path, indexMax))
+        sizes = [cls.tableSize(kmerLen, canonical) for kmerLen in range(indexMax + 1)]
+        dtypes = [cls.countType(kmerLen).newbyteorder('<') for kmerLen in range(indexMax + 1)]
+        starts = np.cumsum([cls.indexHeader] + [size * dtype.itemsize for size, dtype in zip(sizes, dtypes)]).tolist()  # each table starts where the one before ends
+        counter = cls.__new__(cls)
+        counter.maxMotif = maxMotif
+        counter.canonical = bool(canonical)
+        counter.counts = [np.memmap(path, dtype=dtypes[kmerLen], mode='r', offset=starts[kmerLen], shape=(sizes[kmerLen],))
+                          for kmerLen in range(maxMotif + 1)]
+        counter.sequenceLen = sequenceLen
+        counter.tail = np.zeros(0, dtype=np.int8)
+        return counter
+
+    def reverseComplement(self, codes, kmerLen):
+        '''Reverse complements kmer codes.
+
+        Arguments:
+            codes -- an integer array of kmer codes of length kmerLen
+        Returns:
+            the codes of the reverse complements
+        '''
+        codes = np.asarray(codes, dtype=np.int64)
+        reverse = np.zeros_like(codes)
+        for position in range(kmerLen):
+            reverse = reverse * 4 + (3 - ((codes >> (2 * position)) & 3))  # the complement of the last base comes first
+        return reverse
+
+    def lookup(self, kmerLen, codes):
+        '''Finds the counts of kmer codes.
+
+        When canonical, each code is folded onto its canonical bin, so both a kmer and its
+        reverse complement get the two strand count.
+        Arguments:
+            kmerLen -- the length of the kmers
+            codes -- an integer array of kmer codes, any of the 4**kmerLen codes
+        Returns:
+            an array with the count of each code
+        '''
+        if not self.canonical:
+            return self.counts[kmerLen][codes]
+        return self.counts[kmerLen][self.canonicalBins(codes, self.reverseComplement(codes, kmerLen), kmerLen)]
+
+    @staticmethod
+    def tableSize(kmerLen, canonical=False):
+        '''The number of bins of a kmer length.
+
+        Returns:
+            4**k, or (4**k + 2**k) / 2 canonical bins for an even k (the 2**k palindromes have a bin of their own)
+            and 4**k / 2 for an odd k
+        '''
+        if not canonical:
+            return 4 ** kmerLen
+        return (4 ** kmerLen + (2 ** kmerLen if kmerLen % 2 == 0 else 0)) // 2
+
+    @staticmethod
+    def canonicalBins(codes, reverse, kmerLen):
+        '''Folds kmer codes onto canonical bins with half-kmer arithmetic, a kmer and its reverse complement share a bin.
+
+        For an even k, a kmer is its first half a and last half b, and its reverse complement starts with rc(b).
+        The pair {a, rc(b)} is the same for both strands, so lo = min and hi = max of it index a triangle,
+        hi * (hi + 1) / 2 + lo. For an odd k, exactly one strand has A or C as its middle base, and that strand
+        without the high bit of its middle base is the bin.
+        Arguments:
+            codes -- an integer array of kmer codes
+            reverse -- the codes of their reverse complements
+        Returns:
+            an int64 array of bins below tableSize(kmerLen, True)
+        '''
+        half = kmerLen // 2
+        if kmerLen % 2 == 0:
+            first, reverseFirst = codes >> (2 * half), reverse >> (2 * half)
+            lo, hi = np.minimum(first, reverseFirst), np.maximum(first, reverseFirst)
+            return hi * (hi + 1) // 2 + lo
+        strand = np.where((codes >> (2 * half)) & 3 <= 1, codes, reverse)  # the strand with A or C in the middle
+        return ((strand >> (2 * half + 2)) << (2 * half + 1)) | (strand & ((1 << (2 * half + 1)) - 1))
+
+    def binCodes(self, bins, kmerLen):
+        '''The canonical code of each canonical bin, the lower of the two strands, the inverse of canonicalBins.
+
+        Arguments:
+            bins -- an integer array of bins
+        Returns:
+            an int64 array of kmer codes
+        '''
+        bins = np.asarray(bins, dtype=np.int64)
+        half = kmerLen // 2
+        if kmerLen % 2 == 0:
+            hi = ((np.sqrt(8.0 * bins + 1) - 1) // 2).astype(np.int64)
+            hi -= hi * (hi + 1) // 2 > bins  # the float square root can be one off
+            hi += (hi + 1) * (hi + 2) // 2 <= bins
+            lo = bins - hi * (hi + 1) // 2
+            halfReverse = self.reverseComplement(np.arange(4 ** half, dtype=np.int64), half)  # a 4**(k/2) lookup
+            return (lo << (2 * half)) | halfReverse[hi]  # first half lo < hi, so this strand is the lower one
+        strand = ((bins >> (2 * half + 1)) << (2 * half + 2)) | (bins & ((1 << (2 * half + 1)) - 1))
+        return np.minimum(strand, self.reverseComplement(strand, kmerLen))
+
+    def fullCounts(self, kmerLen):
+        '''The counts of every kmer of a length, in code order.
+
+        Returns:
+            an array of 4**kmerLen counts
+        '''
+        if not self.canonical:
+            return self.counts[kmerLen]
+        return self.lookup(kmerLen, np.arange(4 ** kmerLen, dtype=np.int64))
+
+    def kmerString(self, code, kmerLen):
+        '''Converts an integer code back to a kmer.
+
+        Returns:
+            the kmer as a string
+        '''
+        kmer = ''
+        for position in range(kmerLen):
+            kmer = self.alphabet[code & 3] + kmer
+            code >>= 2
+        return kmer
+
+
+def countShard(maxMotif, canonical, pieces):
+    '''Counts one shard of the input, runs in a worker process.
+
+    Arguments:
+        maxMotif -- maximum motif size to count
+        canonical -- count both strands into canonical bins
+        pieces -- list of (carry, body, endOfRecord) from MotifSearch.pieces
+    Returns:
+        a KmerCounter with the counts of the shard
+    '''
+    counter = KmerCounter(maxMotif, canonical)
+    if pieces:
+        # the pieces of a shard follow each other, so only the first carry is needed and one update counts them all
+        counter.carryOver(pieces[0][0])
+        counter.updateBatch([(body, endOfRecord) for carry, body, endOfRecord in pieces])
+    return counter
 
 
 class MotifSearch(object):
@@ -13,25 +370,46 @@ class MotifSearch(object):
 
     Attributes:
         minMotif -- minimum motif size to evaluate (default 3)
-        maxMotif -- maximum motif size to evaluate (default 5)
+        maxMotif -- maximum motif size to evaluate (default 5), the count tables take about 4 * 4**maxMotif * 4 / 3
+                    bytes past length 8 (90 MB at 12, half of that when canonical)
         cutoff -- Z-score cutoff (default -5)
         inputFile -- STDIN object
+        chunkSize -- stream the input in chunks of about this many bases (default 0, read it all at once)
+        workers -- number of processes counting kmers (default 1)
+        indexDir -- directory of kmer index files reused across runs on the same input (default None, no index)
+        top -- only report this many of the most under-represented motifs of each length (default None, all)
+        canonical -- count both strands and report canonical motifs, a motif and its reverse complement share a row (default False)
     Methods:
         kmerDic -- creates a kmer dic
         inputSeq --
+        readChunks -- streams the input fasta chunk by chunk
+        pieces -- splits the records into windows that carry their overlap with the previous window
+        shards -- groups the windows into shards for the worker processes
+        shardSize -- the number of bases of a shard
+        countInput -- counts every motif of the input
+        checksum -- the checksum of the input file that keys its index
+        indexPath -- finds an index that covers maxMotif for the input file
+        kmerArrays -- counts every motif into a KmerCounter
         kmerCount -- counts the number of each motif
+        markovStage -- calculates the expected count and Z-score arrays of each motif length
         expectedCount -- calculates the expected number for each motif
         kmerProb -- calculates the probability under null
+        selectMotifs -- selects and sorts the motifs below the cutoff
         cutOff -- removes kmers above cutoff threshold
         dataFrame -- sorting the kmer dict
     '''
-    def __init__(self, inputFile, minMotif=3, maxMotif=8, cutoff=-5):
+    def __init__(self, inputFile, minMotif=3, maxMotif=8, cutoff=-5, chunkSize=0, workers=1, indexDir=None, top=None, canonical=False):
         '''MotifSearch constructor, initialize a new instance of MotifSearch.
         '''
         self.minMotif = minMotif  # min len of the mottif, it has to be -3 at least
         self.maxMotif = maxMotif  # max can be atmost 8
         self.cutoff = cutoff  # cutoff default should be -5
         self.inputFile = inputFile  # path of the input file
+        self.chunkSize = chunkSize  # 0 means the whole input is concatenated by inputSeq
+        self.workers = workers  # more than 1 counts shards of the input in a process pool
+        self.indexDir = indexDir  # only used when inputFile is a path, STDIN can not be checksummed before reading
+        self.top = top  # None keeps every motif below the cutoff
+        self.canonical = canonical
 
     def kmerDic(self, alphabet="ATCG"):
         ''' Returns a dictionary of kmers.
@@ -64,6 +442,181 @@ class MotifSearch(object):
             seq += all_fasta[fastaSeq][1] + "\n"
         return seq  # concate all fasta files and add \n in between them
 
+    def readChunks(self):
+        '''Streams the input fasta without holding a whole record in memory.
+
+        Sequence lines are cleaned the way FastAreader does (whitespace removed, upper case).
+        Returns:
+            yields (chunk, endOfRecord), chunk has about chunkSize bases and endOfRecord is True
+            for the last chunk of each record
+        '''
+        fileH = open(self.inputFile) if self.inputFile else sys.stdin
+        chunk = []
+        chunkLen = 0
+        inRecord = False
+        for line in fileH:
+            if line.startswith('>'):
+                if inRecord:
+                    yield ''.join(chunk), True  # close the previous record
+                chunk = []
+                chunkLen = 0
+                inRecord = True
+            elif inRecord:
+                bases = ''.join(line.split()).upper()
+                chunk.append(bases)
+                chunkLen += len(bases)
+                if chunkLen >= self.chunkSize:
+                    yield ''.join(chunk), False
+                    chunk = []
+                    chunkLen = 0
+        if inRecord:
+            yield ''.join(chunk), True
+        if fileH is not sys.stdin:
+            fileH.close()
+
+    def pieces(self, windowSize):
+        '''Splits the records into windows, large records are split into several windows.
+
+        Arguments:
+            windowSize -- maximum number of bases in a window
+        Returns:
+            yields (carry, body, endOfRecord), carry is the maxMotif - 1 bases before body in the same record
+        '''
+        if self.chunkSize:
+            source = self.readChunks()
+        else:
+            source = ((fastaSeq[1], True) for fastaSeq in FastAreader(self.inputFile).readFasta())
+        carry = ''
+        for chunk, endOfRecord in source:
+            for start in range(0, max(len(chunk), 1), windowSize):  # an empty record still ends a record
+                body = chunk[start:start + windowSize]
+                last = endOfRecord and start + windowSize >= len(chunk)
+                yield carry, body, last
+                if last:
+                    carry = ''
+                else:
+                    carry = (carry + body)[max(0, len(carry) + len(body) - (self.maxMotif - 1)):]
+
+    def shards(self, shardSize):
+        '''Groups windows into shards of about shardSize bases.
+
+        Returns:
+            yields lists of pieces
+        '''
+        shard = []
+        bases = 0
+        for piece in self.pieces(shardSize):
+            shard.append(piece)
+            bases += len(piece[1])
+            if bases >= shardSize:
+                yield shard
+                shard = []
+                bases = 0
+        if shard:
+            yield shard
+
+    def shardSize(self):
+        '''The number of bases of a shard, about two shards per worker for the input file, but at most
+        max(4M, 4**maxMotif) bases so a large input is read a few shards at a time. A shard is sent
+        back as full count arrays, so a shard below that cap is only worth it to keep every worker busy.
+
+        Returns:
+            the shard size in bases
+        '''
+        largest = max(1 << 22, 4 ** self.maxMotif)
+        if not self.inputFile:
+            return largest  # STDIN has no size
+        inputSize = os.path.getsize(self.inputFile)
+        return max(1 << 12, min(largest, -(-inputSize // (2 * self.workers))))
+
+    def checksum(self):
+        '''Checksums the input file.
+
+        Returns:
+            the sha1 hex digest of the input file
+        '''
+        digest = hashlib.sha1()
+        with open(self.inputFile, 'rb') as fileH:
+            for block in iter(functools.partial(fileH.read, 1 << 20), b''):
+                digest.update(block)
+        return digest.hexdigest()
+
+    def indexPath(self, checksum):
+        '''Finds an index of the input file that holds kmers up to at least maxMotif.
+
+        Index files are named <checksum>.k<maxMotif>.idx inside indexDir, or <checksum>.c<maxMotif>.idx
+        for canonical counts.
+        Returns:
+            the path of the smallest index that covers maxMotif, or None
+        '''
+        candidates = []
+        prefix = '.c' if self.canonical else '.k'
+        for path in glob.glob(os.path.join(self.indexDir, checksum + prefix + '*.idx')):
+            indexMax = int(path[:-len('.idx')].rsplit(prefix, 1)[1])
+            if indexMax >= self.maxMotif:
+                candidates.append((indexMax, path))
+        if candidates:
+            return min(candidates)[1]
+        return None
+
+    def countInput(self):
+        '''Counts every kmer of the input, in a process pool, streamed or all at once.
+
+        Returns:
+            A KmerCounter holding the count of every motif of length 1 through maxMotif
+        '''
+        counter = KmerCounter(self.maxMotif, self.canonical)
+        if self.workers > 1:
+            pending = collections.deque()  # at most 2 shards per worker are read ahead, so memory stays bounded
+            with multiprocessing.Pool(self.workers) as pool:
+                for shard in self.shards(self.shardSize()):
+                    if len(pending) >= 2 * self.workers:
+                        counter.merge(pending.popleft().get())
+                    pending.append(pool.apply_async(countShard, (self.maxMotif, self.canonical, shard)))
+                while pending:
+                    counter.merge(pending.popleft().get())
+        elif self.chunkSize:
+            # memory is bounded by the batch size, chunks are batched up to the size of the count arrays
+            # (at most 4M bases) so an update is not paid per small chunk or short record
+            batchSize = max(self.chunkSize, min(4 ** self.maxMotif, 1 << 22))
+            batch = []
+            batchLen = 0
+            for chunk, endOfRecord in self.readChunks():
+                batch.append((chunk, endOfRecord))
+                batchLen += len(chunk)
+                if batchLen >= batchSize:
+                    counter.updateBatch(batch)
+                    batch = []
+                    batchLen = 0
+            counter.updateBatch(batch)
+        else:
+            counter.update(self.inputSeq())  # the \n separators keep kmers from spanning two records
+        return counter
+
+    def kmerArrays(self):
+        '''Counting kmers into flat count arrays.
+
+        With an indexDir, an index of the same input with at least maxMotif is opened instead
+        of counting, and a fresh count is saved as a new index.
+        Returns:
+            A KmerCounter holding the count of every motif of length 1 through maxMotif
+            '''
+        if self.indexDir and self.inputFile:
+            checksum = self.checksum()
+            path = self.indexPath(checksum)
+            if path is None:
+                counter = self.countInput()
+                os.makedirs(self.indexDir, exist_ok=True)
+                counter.save(os.path.join(self.indexDir, '%s.%s%d.idx' % (checksum, 'c' if self.canonical else 'k', self.maxMotif)))
+            else:
+                counter = KmerCounter.fromIndex(path, self.maxMotif)  # zero-copy, the arrays are views of the file
+        else:
+            counter = self.countInput()
+        self.counter = counter
+        self.counts = counter.counts
+        self.sequenceLen = counter.sequenceLen  # the seq len (includes 'n')
+        return counter
+
     def kmerCount(self):
         '''Counting kmers.
 
@@ -71,16 +624,52 @@ class MotifSearch(object):
             A dict with the number of each motif
             '''
         dic = self.kmerDic()  # loading the dic
-        sequence = self.inputSeq()  # loading the sequence
-        sequenceLen = len(sequence)  # findnig the seq len (includes 'n')
-        for index in np.arange(0, sequenceLen + 1):
-            for kmerLen in np.arange(1, self.maxMotif + 1):
-                kmer = sequence[index:index + kmerLen]
-                if kmer in dic:  # only counting canonical nucleotides
-                    dic[kmer][2] = dic[kmer][2] + 1
-        self.sequenceLen = sequenceLen
+        counter = self.kmerArrays()
+        # kmerDic lists the kmers of each length in code order, so the arrays line up with the dic
+        allCounts = itertools.chain.from_iterable(counter.fullCounts(kmerLen).tolist() for kmerLen in range(1, self.maxMotif + 1))
+        for value, count in zip(dic.values(), allCounts):
+            value[2] = count
         return dic
 
+    def markovStage(self, minMotif=3, blockSize=1 << 16):
+        '''Calculates the expected count and Z-score of every motif with index arithmetic on the count arrays.
+
+        The kmer codes of each length are processed in blocks of blockSize, so memory does not grow with 4**maxMotif;
+        a block holds about fifteen float64 temporaries, 8 MB at the default blockSize.
+        When canonical, only canonical kmers are evaluated, against the two strand counts.
+        Arguments:
+            minMotif -- smallest motif size to evaluate, motifs shorter than 3 have no expected count
+            blockSize -- number of kmer codes evaluated at once
+        Returns:
+            yields (kmerLen, codes, count, expected, zScore) arrays for each block,
+            expected and zScore are NaN where they are not defined
+        '''
+        counter = self.counter
+        sequenceLen = self.sequenceLen
+        for kmerLen in range(max(3, minMotif), self.maxMotif + 1):
+            subMask = 4 ** (kmerLen - 1) - 1  # keeps the last kmerLen - 1 bases of a code
+            midMask = 4 ** (kmerLen - 2) - 1  # keeps the last kmerLen - 2 bases of a code
+            numCodes = len(counter.counts[kmerLen])
+            for start in range(0, numCodes, blockSize):
+                stop = min(start + blockSize, numCodes)
+                if counter.canonical:
+                    codes = counter.binCodes(np.arange(start, stop), kmerLen)
+                else:
+                    codes = np.arange(start, stop, dtype=np.int64)
+                firstPortion = codes >> 2  # ex AT from ATC
+                secondPortion = codes & subMask  # ex TC from ATC
+                middlePortion = firstPortion & midMask  # ex T from ATC
+                middleValue = counter.lookup(kmerLen - 2, middlePortion).astype(np.float64)  # the uint32 products would wrap
+                with np.errstate(divide='ignore', invalid='ignore'):
+                    expected = np.where(middleValue > 0,
+                                        counter.lookup(kmerLen - 1, firstPortion).astype(np.float64) * counter.lookup(kmerLen - 1, secondPortion) / middleValue,
+                                        np.nan)
+                    probability = expected / sequenceLen
+                    sd = np.sqrt(sequenceLen * probability * (1 - probability))
+                    count = np.asarray(counter.counts[kmerLen][start:stop])
+                    zScore = np.where((probability > 0) & (probability < 1), (count - expected) / sd, np.nan)
+                yield kmerLen, codes, count, expected, zScore
+
     def expectedCount(self):
         '''Calculates the expected motif count.
 
@@ -88,19 +677,10 @@ class MotifSearch(object):
             dict with an expected count column
         '''
         dic = self.kmerCount()  # get the dic with counted values
-        for kmer, value in dic.items():
-            if len(kmer) >= 3:  # ec ATC
-                firstPortion = kmer[0:-1]  # ex AT
-                secondPortion = kmer[1:]  # ex  TC
-                middlePortion = kmer[1:-1]  # ex T
-                firstValue = dic[firstPortion][2]  # findin the actual count of AT
-                secondValue = dic[secondPortion][2]  # findin the actual count of TC
-                middleValue = dic[middlePortion][2]  # findin the actual count of T
-                # now, what if the actual count of T is zero? maybe I should set the middle_portion to 1 if there is nothing?
-                if middleValue == 0:
-                    pass
-                else:
-                    dic[kmer].append(firstValue*secondValue/middleValue) # return e(kmer)
+        for kmerLen, codes, count, expected, zScore in self.markovStage():
+            defined = ~np.isnan(expected)
+            for code, e in zip(codes[defined].tolist(), expected[defined].tolist()):
+                dic[self.counter.kmerString(code, kmerLen)].append(e)  # return e(kmer)
         return dic
 
     def kmerProb(self):
@@ -110,34 +690,57 @@ class MotifSearch(object):
             A dict with kmer probability
         '''
         dic = self.expectedCount()  # loading the dic: kmer, kmer_len, actual count, expected count
-        sequenceLen = self.sequenceLen
-        for kmer, value in dic.items():
-            if len(value) >= 4:
-                probability = float(value[3]/sequenceLen)
-                if probability == 0:
-                    pass
-                else:
-                    mean = value[3]
-                    sd = (sequenceLen*probability*(1-probability))**(1/2)
-                    zScore = (value[2]-mean)/sd
-                    dic[kmer].append(zScore)
+        for kmerLen, codes, count, expected, zScore in self.markovStage():
+            defined = ~np.isnan(zScore)
+            for code, z in zip(codes[defined].tolist(), zScore[defined].tolist()):
+                dic[self.counter.kmerString(code, kmerLen)].append(z)
         return dic
 
+    def selectMotifs(self):
+        '''Selects the motifs with zScores below the cutoff, sorted by length and zScore.
+
+        With top set, only the top most under-represented motifs of each length are kept, partitioning
+        each block so the selection never holds more than top + blockSize rows. Of the rows tied at the
+        boundary zScore only those are sorted, by code, and the lowest codes are kept, like the full sort.
+        Returns:
+            a list of (kmerLen, codes, count, expected, zScore) arrays, longest motifs first and
+            the lowest zScore first within a length
+        '''
+        self.kmerArrays()
+        selected = {}
+        for kmerLen, codes, count, expected, zScore in self.markovStage(self.minMotif):
+            keep = zScore <= self.cutoff  # NaN Z-scores never pass
+            block = [codes[keep], count[keep], expected[keep], zScore[keep]]
+            if kmerLen in selected:
+                block = [np.concatenate(pair) for pair in zip(selected[kmerLen], block)]
+            if self.top is not None and len(block[3]) > self.top:
+                order = np.zeros(0, dtype=np.int64)
+                if self.top:
+                    bound = np.partition(block[3], self.top - 1)[self.top - 1]  # the top-th lowest zScore
+                    below = np.flatnonzero(block[3] < bound)
+                    tied = np.flatnonzero(block[3] == bound)
+                    tied = tied[np.argsort(block[0][tied], kind='stable')]  # canonical blocks are not in code order
+                    order = np.concatenate((below, tied[:self.top - len(below)]))
+                block = [column[order] for column in block]
+            selected[kmerLen] = block
+        table = []
+        for kmerLen in sorted(selected, reverse=True):
+            codes, count, expected, zScore = selected[kmerLen]
+            order = np.lexsort((codes, zScore))
+            table.append((kmerLen, codes[order], count[order], expected[order], zScore[order]))
+        return table
+
     def cutOff(self):
         '''removes rows with zScores above the cutoff.
 
+        Only the motifs that pass the cutoff are turned into rows, the rest stay in the arrays.
         Returns:
             a dict with zScores bellow the cutoff'''
-        dic = self.kmerProb()
-        for key in list(dic):
-            if len(dic[key]) <= 4:
-                dic.pop(key, None)
-
-        for key in list(dic):
-            if len(dic[key]) >= 5:
-                if dic[key][4] > self.cutoff:
-                    dic.pop(key, None)
-
+        dic = {}
+        for kmerLen, codes, count, expected, zScore in self.selectMotifs():
+            for code, actual, e, z in zip(codes.tolist(), count.tolist(), expected.tolist(), zScore.tolist()):
+                kmer = self.counter.kmerString(code, kmerLen)
+                dic[kmer] = [kmer, kmerLen, actual, e, z]
         return dic
 
     def dataFrame(self):
@@ -146,16 +749,11 @@ class MotifSearch(object):
         Returns:
             STDOUT a sorted and labled table
         '''
-        finalDic = self.cutOff()
-        valueList = []
-        for i, k in finalDic.items():
-            valueList.append(k)
-        valueList.sort(key=lambda x: (x[1],-x[4]), reverse= True)
-        for i in valueList:
-            del i[1]
-        valueList.insert(0, ['Motif', 'actual count', 'expected count', 'Zscore'])
-        for i in valueList:
-            sys.stdout.write("\t".join(map(str, i)) + '\n')
+        sys.stdout.write("\t".join(['Motif', 'actual count', 'expected count', 'Zscore']) + '\n')
+        for kmerLen, codes, count, expected, zScore in self.selectMotifs():
+            for code, actual, e, z in zip(codes.tolist(), count.tolist(), expected.tolist(), zScore.tolist()):
+                row = [self.counter.kmerString(code, kmerLen), actual, e, z]
+                sys.stdout.write("\t".join(map(str, row)) + '\n')
 
 def main():
     '''creates an instance of the MotifSearch class, sets the arguments, and calls the methods'''
@@ -163,8 +761,14 @@ def main():
     parser.add_argument('-min', '--minMotif', type=int, default=3, help='the minimum motif size to evaluate')
     parser.add_argument('-max', '--maxMotif', type=int, default=8, help='the maximum motif size to evaluate')
     parser.add_argument('-cut', '--cutoff', type=int, default=-5, help='the Z-score cutoff')
+    parser.add_argument('-chunk', '--chunkSize', type=int, default=0, help='stream the input in chunks of this many bases (0 reads it all at once)')
+    parser.add_argument('-w', '--workers', type=int, default=1, help='number of processes counting kmers')
+    parser.add_argument('-i', '--inputFile', default='', help='the input fasta file (default STDIN)')
+    parser.add_argument('-idx', '--indexDir', default=None, help='directory of kmer count indexes reused across runs on the same input file')
+    parser.add_argument('-top', '--top', type=int, default=None, help='only report the N most under-represented motifs of each length')
+    parser.add_argument('-rc', '--canonical', action='store_true', help='count both strands into canonical motifs')
     args = parser.parse_args()
-    f = MotifSearch("", args.minMotif, args.maxMotif, args.cutoff)
+    f = MotifSearch(args.inputFile, args.minMotif, args.maxMotif, args.cutoff, args.chunkSize, args.workers, args.indexDir, args.top, args.canonical)
     f.dataFrame()
 
 if __name__ == "__main__":
@@ -1,6 +1,29 @@
 import sys
 import numpy as np
 
+def encodeSymbols(sequence, alphabet):
+    '''Encodes a string as the index of each of its characters in alphabet.
+    The characters are read as utf-32 code points and looked up in the sorted alphabet,
+    so the string is encoded without a Python loop.
+    Returns:
+        an int array of ids'''
+    codes = np.frombuffer(sequence.encode('utf-32-le'), dtype=np.uint32)
+    charCodes = np.array([ord(char) for char in alphabet], dtype=np.uint32)
+    order = np.argsort(charCodes)
+    index = np.minimum(np.searchsorted(charCodes[order], codes), len(order) - 1)
+    if (charCodes[order][index] != codes).any():
+        raise ValueError('the sequence has characters that are not in the alphabet')
+    return order[index]
+
+def probabilityArrays(transition, emission, states, observedChar):
+    '''Converts the transition and emission dicts of an HMM to arrays indexed by state/symbol ids.
+    Returns:
+        transition - (states x states) array, row is the previous state
+        emission - (states x observedChar) array'''
+    transitionArray = np.array([[transition[state][nextState] for nextState in states] for state in states], dtype=float)
+    emissionArray = np.array([[emission[state][char] for char in observedChar] for state in states], dtype=float)
+    return transitionArray, emissionArray
+
 class ViterbiPath(object):
     def __init__(self, observation, transition, emission, states, observedChar ):
         '''Finds the path that maximizes the  probability Pr(x, π) over all possible paths π.
@@ -11,6 +34,9 @@ class ViterbiPath(object):
             emission - emission matrix
             transition - transition matrix
         Methods:
+            modelArrays - log transition and log emission arrays indexed by state/symbol ids
+            encodeObservation - the observation as an array of symbol ids
+            logViterbi - the Viterbi path as state ids, computed in log space
             viterbiPath - a path that maximizes the probability Pr(x, π) over all possible paths'''
 
         self.observation = observation
@@ -19,43 +45,56 @@ class ViterbiPath(object):
         self.observedChar = observedChar
         self.states = states
 
+    def modelArrays(self):
+        '''Converts the transition and emission dicts to log-probability arrays.
+        returns:
+            logTransition - (states x states) array, row is the previous state
+            logEmission - (states x observedChar) array'''
+        transition, emission = probabilityArrays(self.transition, self.emission, self.states, self.observedChar)
+        with np.errstate(divide='ignore'): # log(0) is -inf, an impossible move
+            return np.log(transition), np.log(emission)
+
+    def encodeObservation(self):
+        '''Encodes the observation as symbol ids, the index of each character in observedChar.
+        returns:
+            an int array of symbol ids'''
+        return encodeSymbols(self.observation, self.observedChar)
+
+    def logViterbi(self):
+        '''Finds the Viterbi path in log space, so long observations do not underflow.
+        Each column is the max over a broadcast (state x previous state) log-probability matrix,
+        and the backpointers go into an int32 array.
+        returns:
+            path - an array of state ids
+            logProb - the log probability of the path'''
+        logTransition, logEmission = self.modelArrays()
+        observation = self.encodeObservation()
+        numStates = len(self.states)
+        # stepScore[symbol][state][prevState], the log probability of moving prevState -> state and emitting symbol
+        stepScore = np.ascontiguousarray(logTransition.T[None, :, :] + logEmission.T[:, :, None])
+        backpointers = np.zeros((len(observation), numStates), dtype=np.int32)
+        score = np.log(1.0 / numStates) + logEmission[:, observation[0]]
+        column = np.empty((numStates, numStates))
+        stateIds = np.arange(numStates)
+        for characterIndex in range(1, len(observation)):
+            np.add(stepScore[observation[characterIndex]], score, out=column)
+            best = column.argmax(axis=1) # the first best prevState, like the strict > of the dict version
+            backpointers[characterIndex] = best
+            score = column[stateIds, best]
+        #backtracking, ties at the end go to the last state
+        path = np.empty(len(observation), dtype=np.int64)
+        path[-1] = numStates - 1 - score[::-1].argmax()
+        for characterIndex in range(len(observation) - 1, 0, -1):
+            path[characterIndex - 1] = backpointers[characterIndex, path[characterIndex]]
+        return path, score[path[-1]]
+
     def viterbiPath(self):
 
         '''Returns a path that maximizes the probability Pr(x, π) over all possible paths.
         returns:
             A path of states'''
-        probPrev = [{state : {"currentProb" : (1.0/len(self.states)) * self.emission[state][self.observation[0]], "prevState" : None} for state in self.states}] # starting a dict with prev state of None and current robability of neing in state A or B as currentProb
-        for characterIndex in range(1, len(self.observation)): # for each position in the observed, first I calculated the max probability of the path that ends in that position, then I multiply that by the emission
-            probPrev.append({}) #for each position append a new dict to the probPrev
-            for state in self.states: # I0, M1,I1, D2 ...
-                maxProb = 0.0
-                prevState  = ''
-                for prev_state in self.states:
-                    prob, prev_st = (probPrev[characterIndex-1][prev_state]["currentProb"] * self.transition[prev_state][state] * self.emission[state][self.observation[characterIndex]], prev_state)
-                    if prob > maxProb:
-                        maxProb = prob
-                        prevState = prev_st
-                probPrev[characterIndex][state] = {"currentProb" : maxProb, "prevState" : prevState}
-
-        #backtracking
-        stateProb = float('-inf')
-        L = ''
-        statePath = ''
-        # first we only look at the end point, and pick the state with the highest probability for the end, and based on that state we record the prev state
-        for state in self.states: # from the end, I pick the state with the highest probability
-            endProb = probPrev[-1].get(state, {}).get('currentProb') # get the probability
-            prevState = probPrev[-1].get(state, {}).get('prevState') # get the prevState
-            if endProb >= stateProb: # only if the the probability is higher greated than other states
-                stateProb = endProb
-                L = prevState
-                currentState = state
-        statePath =  statePath + currentState + L
-        # now we are looking at everything before the end state
-        for j in range(-2, -len(self.observation), -1): # we start from -2 since the last node (-1) is resolved
-            K =  probPrev[j].get(L, {}).get('prevState') #get the prev
-            L = K
-            statePath += L
-        return statePath[::-1]
+        path, logProb = self.logViterbi()
+        return ''.join([self.states[state] for state in path.tolist()])
 
 def main():
     '''Process the input file, create an object of the class, and create the output'''
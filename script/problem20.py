@@ -27,19 +27,31 @@ class RosalindParse(object):
 
 class HmmProfile(object):
     '''Construct a Profile HMM.
+    The alignment is encoded once as a uint8 array, and the states are numbered in the order of columnLabel:
+    S = 0, I0 = 1, Mk = 3k - 1, Dk = 3k, Ik = 3k + 1 and E = 3 * (number of match columns) + 2.
     Attributes:
         theta - theta value
         observations - the observed sequence
         observedChar - the observed characters
     Methodes:
         mpMatrix - Creates a matrix of the multiple alignment
+        encodeAlignment - Creates the uint8 array of the multiple alignment
+        blocks - Splits the sequences into blocks
+        columnCharCounts - Counts the characters of each column
         belowTheta - Finding the columns that are to be treated as inserts
+        columnStates - Finds the match and deletion state id of each column
+        cellStates - Finds the state id of each cell of a block of sequences
+        profileCounts - Counts the transitions and emissions of all sequences
         transitionStates - Finds the transition states for each sequence
         transitionBackbone - Creates the transition backbone
         transitionProb - Creates the transition probability  matrix
         emissionBackbone - creates the emission backbone
         emissionProb - Creates the emission probability matrix
+        columnLabel - the state labels
     '''
+    gap = ord('-')
+    maxStep = 5 # a transition moves from state id p to one of p .. p + 4
+
     def __init__(self, theta, observations, observedChar):
         self.theta = theta
         self.observations = observations
@@ -62,18 +74,97 @@ class HmmProfile(object):
         self.multipleAlignment = multipleAlignment
         return multipleAlignment
 
+    def encodeAlignment(self):
+        '''Creates the multiple alignment as a (sequences x columns) uint8 array of character codes, built once.
+        Returns:
+            the alignment array'''
+        if getattr(self, 'alignment', None) is None:
+            numColumns = len(self.observations[0])
+            joined = ''.join(self.observations).encode()
+            if len(joined) != numColumns * len(self.observations):
+                raise ValueError('the aligned sequences must be single byte characters of the same length')
+            self.alignment = np.frombuffer(joined, dtype=np.uint8).reshape(len(self.observations), numColumns)
+        return self.alignment
+
+    def blocks(self):
+        '''Splits the sequences into blocks of about 4M cells, so the per cell arrays stay small.
+        Returns:
+            a list of (first, last) sequence indices'''
+        numRows, numColumns = self.encodeAlignment().shape
+        blockRows = max(1, (1 << 22) // max(1, numColumns))
+        return [(start, min(start + blockRows, numRows)) for start in range(0, numRows, blockRows)]
+
+    def columnCharCounts(self):
+        '''Counts each observed character and the gap in each column, built once.
+        Returns:
+            a (columns x observedChar + 1) array of counts, the last column counting the gaps'''
+        if getattr(self, 'charCounts', None) is None:
+            alignment = self.encodeAlignment()
+            codes = np.frombuffer((''.join(self.observedChar) + '-').encode(), dtype=np.uint8)
+            charCounts = np.zeros((alignment.shape[1], len(codes)), dtype=np.int64)
+            for start, end in self.blocks():
+                for n, code in enumerate(codes):
+                    charCounts[:, n] += np.add.reduce(alignment[start:end] == code, axis=0, dtype=np.int32)
+            if (charCounts.sum(axis=1) != len(alignment)).any():
+                raise ValueError('the alignment has characters that are not in observedChar')
+            self.charCounts = charCounts
+        return self.charCounts
+
     def belowTheta(self):
         '''Finding columns that the ratio of (-)/the number of sequences are above the threshold.
         Returns:
             column indices that are above the threshold ( in list format).'''
-        multipleAlignment = self.mpMatrix()# get the alignment matrix
-        insertColumns = [] # the  indices of columns that should be considered as insertion
-        for i in range(multipleAlignment.shape[1]):
-            x = list(multipleAlignment[:, i]).count('-')/len(multipleAlignment)
-            if x >= self.theta:
-                insertColumns.append(i)
-        self.insertColumns = insertColumns
-        return insertColumns
+        self.insertMask = self.columnCharCounts()[:, -1] / len(self.alignment) >= self.theta
+        self.insertColumns = np.flatnonzero(self.insertMask).tolist()
+        return self.insertColumns
+
+    def columnStates(self):
+        '''Numbers the columns once, a match column k holds Mk and Dk, and an insert column after match column k holds Ik.
+        Returns:
+            the state id of a character in each column (M or I), and the number of match columns'''
+        if getattr(self, 'columnIds', None) is None:
+            self.belowTheta()
+            matchIndex = np.cumsum(~self.insertMask, dtype=np.int32) # the index of the last match column up to this column
+            self.numMatch = int(matchIndex[-1]) if len(matchIndex) else 0
+            self.columnIds = np.where(self.insertMask, 3 * matchIndex + 1, 3 * matchIndex - 1).astype(np.int32)
+        return self.columnIds, self.numMatch
+
+    def cellStates(self, start, end):
+        '''The state of each cell of sequences start to end, between an S and an E column.
+        A character is M or I, a gap is D (M + 1) in a match column and no state (-1) in an insert column.
+        Returns:
+            a (sequences x columns + 2) int32 array of state ids'''
+        columnIds, numMatch = self.columnStates()
+        isGap = self.alignment[start:end] == self.gap
+        states = np.empty((end - start, len(columnIds) + 2), dtype=np.int32)
+        states[:, 0] = 0
+        np.add(columnIds, isGap, out=states[:, 1:-1])
+        states[:, -1] = 3 * numMatch + 2
+        states[:, 1:-1][isGap & self.insertMask] = -1
+        return states
+
+    def profileCounts(self):
+        '''Counts the transitions of all sequences with bincount, one block of sequences at a time,
+        and the emissions from the per column character counts, once per profile.
+        Returns:
+            transition counts as (states x 5), column j counting the transitions from state p to state p + j
+            emission counts as (states x observedChar)'''
+        if getattr(self, 'counts', None) is not None: # counted once, shared by transitionProb and emissionProb
+            return self.counts
+        columnIds, numMatch = self.columnStates()
+        numStates = 3 * numMatch + 3
+        transitionCounts = np.zeros(numStates * self.maxStep, dtype=np.int64)
+        for start, end in self.blocks():
+            states = self.cellStates(start, end)
+            path = states[states >= 0] # the state paths of the sequences one after the other, S ... E S ... E
+            prev = path[:-1]
+            pairs = prev * self.maxStep + (path[1:] - prev)
+            transitionCounts += np.bincount(pairs[prev != numStates - 1], minlength=numStates * self.maxStep) # E to the next S is not a transition
+
+        emissionCounts = np.zeros((numStates, len(self.observedChar)), dtype=np.int64)
+        np.add.at(emissionCounts, columnIds, self.columnCharCounts()[:, :-1])
+        self.counts = (transitionCounts.reshape(numStates, self.maxStep), emissionCounts)
+        return self.counts
 
     def transitionStates(self):
         '''Finding the transition states for each sequence.
@@ -84,153 +175,62 @@ class HmmProfile(object):
                 [['M1', 'M2', 'M3', 'I3', 'M4', 'M5', 'M6', 'M7'],
                  ['D1', 'M2', 'M3', 'I3', 'M4', 'I4', 'M5', 'M6', 'M7'],
                   ['M1', 'M2', 'M3', 'I3', 'M4', 'M5', 'M6', 'M7']'''
-        insertColumns = self.belowTheta() # a list of column indices that must be considered as insertion
+        labels = self.columnLabel()
         stateList = [] # a list containing the state observations for each sequence
-        for alignment in range(self.multipleAlignment.shape[0]):
-            temp = []
-            index = 1
-            for columnIndex in range(self.multipleAlignment.shape[1]):
-                if columnIndex in insertColumns: # if the column is in the insertColumn list
-                    if self.multipleAlignment[alignment][columnIndex] != '-': # if we have '-'
-                        temp.append('I' + str(index -1)) # we are going to get insetion
-                else: # if it is not in the inserColumn list
-                    if self.multipleAlignment[alignment][columnIndex] != '-': # if we see '-'
-                        temp.append('M' + str(index)) # we are going to have match
-                        index += 1
-                    elif self.multipleAlignment[alignment][columnIndex] == '-': # if we don't have '-'
-                        temp.append('D' + str(index)) # we will have deletion
-                        index += 1
-            stateList.append(temp)
+        for start, end in self.blocks():
+            for states in self.cellStates(start, end)[:, 1:-1]:
+                stateList.append([labels[state] for state in states[states >= 0].tolist()])
         self.stateList = stateList
         return stateList
 
     def transitionBackbone(self):
-        '''Construction the transition backbone.
+        '''Construction the transition backbone, an empty dict per state to hold its successors only,
+        a state has at most three, so the backbone grows with the number of columns and not its square.
         Returns:
             an empty transition dict, with structure of dict of dict'''
-        stateList = self.transitionStates() # get the list of transition states ( list of lists, each sub list coresponding to one of the sequences in order)
-        transition = {}
-        transition['S'] = {}
-        transition['I0'] = {}
-        for i in range(1, len(self.observations[0])-len(self.insertColumns) +1 ):
-            transition['M' + str(i)] = {}
-            transition['D' + str(i)] = {}
-            transition['I' + str(i)] = {}
-        transition['E'] = {}
-
-        for k,v in transition.items():
-            for kk in transition.keys():
-                transition[k][kk] = 0 # assigning 0 to dic of dict values
+        labels = self.columnLabel()
+        transition = {k : {} for k in labels} # a missing successor is a 0 transition
         self.transition = transition
         return transition
 
     def transitionProb(self):
-        '''Create the transition probability, in dict of dict structure.
+        '''Create the transition probability, in dict of dict structure, only the nonzero transitions are stored.
         Returns:
             the transition probability'''
         transition = self.transitionBackbone() #get the backbone
-        for row in self.stateList: # self.stateList is explained in transitionStates docstring
-            prev = '' # here I'm just counting
-            for index, item in enumerate(row):
-                if index == 0:
-                    if item != "-":
-                        transition['S'][item] += 1
-                        prev = item
-                    else:
-                        transition['I0'][item] += 1
-                        prev = item
-                else:
-                    self.transition[prev][item] += 1
-                    prev = item
-                    if index == len(row) - 1:
-                        self.transition[prev]['E'] += 1
-        #here I'm creating the probability
-        for k,v in transition.items():
-            s = sum(transition[k].values()) # sum of the values
-            if s !=0: # if the sum is not zero ( to avoid devision by zero)
-                for j,ll in v.items(): #for each key and value in v
-                    if ll != 0: # if the value is not zero , because the rosalind does not want to see 0.0
-                            transition[k][j] = float(ll/s) # calculating the probability
+        labels = self.columnLabel()
+        counts, emissionCounts = self.profileCounts()
+        total = counts.sum(axis=1)
+        for state, step in zip(*np.nonzero(counts)):
+            transition[labels[state]][labels[state + step]] = float(counts[state][step] / total[state]) # calculating the probability
         return transition
 
     def emissionBackbone(self):
         '''Constructing the emission backbone, dict of dic.
         Returns:
             the emission backbone, with dict of dict structure'''
-        insertColumns = self.belowTheta() # a list of column indices that must be considered as insertion
-        emission = {}
-        emission['S'] = {}
-        emission['I0'] = {}
-        for i in range(1, len(self.observations[0])-len(self.insertColumns) +1 ):
-            emission['M' + str(i)] = {}
-            emission['D' + str(i)] = {}
-            emission['I' + str(i)] = {}
-        emission['E'] = {}
-        #here I'm just assigning 0
-        for i,j in emission.items():
-            for state in self.observedChar:
-                emission[i][state] = 0
-        return emission
+        return {i : {state : 0 for state in self.observedChar} for i in self.columnLabel()}
 
     def emissionProb(self):
-        '''Calculating the emission probability, with structure of dict of dict.
+        '''Calculating the emission probability, with structure of dict of dict, zeros are left as int 0.
         Returns:
             the emission probability'''
         emission = self.emissionBackbone() # getting the emission backbone
-        #here I'm just counting
-        e = {}
-        for j in range(self.multipleAlignment.shape[0]):
-            index = 1
-            for i in range(self.multipleAlignment.shape[1]):
-                if i not in self.insertColumns:
-                    if self.multipleAlignment[j][i] != '-':
-                        if 'M' + str(index) not in e:
-                            e['M' + str(index)] = [self.multipleAlignment[j][i]]
-                            index += 1
-                        else:
-                            e['M' + str(index)].append(self.multipleAlignment[j][i])
-                            index += 1
-                    elif self.multipleAlignment[j][i] == '-':
-                        if 'D' + str(index) not in e:
-                            e['D' + str(index)] = [self.multipleAlignment[j][i]]
-                            index += 1
-                        else:
-                            e['D' + str(index)].append(self.multipleAlignment[j][i])
-                            index += 1
-
-                else:
-                    if self.multipleAlignment[j][i] != '-':
-                        if 'I' + str(index -1) not in e:
-                            e['I' + str(index -1)] = [self.multipleAlignment[j][i]]
-                        else:
-                            e['I' + str(index -1)].append(self.multipleAlignment[j][i])
-
-        for k,v in e.items():
-            for i in v:
-                if i != '-':
-                    emission[k][i] +=1
-
-        #making the probability
-        for wq,er in emission.items():
-            ss = sum(er.values())
-            if ss != 0:
-                for j,ll in er.items():
-                    if ll != 0:
-                        emission[wq][j] = float(ll/ss)
+        labels = self.columnLabel()
+        transitionCounts, counts = self.profileCounts()
+        total = counts.sum(axis=1)
+        for state, char in zip(*np.nonzero(counts)):
+            emission[labels[state]][self.observedChar[char]] = float(counts[state][char] / total[state])
         return emission
 
     def columnLabel(self):
-        '''Constructing the emission backbone, dict of dic.
+        '''The state labels, in state id order.
         Returns:
-            the emission backbone, with dict of dict structure'''
-        insertColumns = self.belowTheta() # a list of column indices that must be considered as insertion
-        x = []
-        x.append('S')
-        x.append('I0')
-        for i in range(1, len(self.observations[0])-len(self.insertColumns) +1 ):
-            x.append('M' + str(i))
-            x.append('D' + str(i))
-            x.append('I' + str(i))
+            a list of the state labels'''
+        columnIds, numMatch = self.columnStates()
+        x = ['S', 'I0']
+        for i in range(1, numMatch + 1):
+            x.extend(['M' + str(i), 'D' + str(i), 'I' + str(i)])
         x.append('E')
         return x
 
@@ -255,7 +255,7 @@ class OutputFormat(object):
         for key in self.columns:
             sys.stdout.write(key)
             for insideKey in self.columns:
-                element = self.transition[key][insideKey]
+                element = self.transition[key].get(insideKey, 0)
                 if element == 0:
                     sys.stdout.write('\t' + str(element))
                 else:
@@ -269,7 +269,7 @@ class OutputFormat(object):
         for key in self.columns:
             sys.stdout.write(key)
             for insideKey in self.observedChar:
-                element = self.emission[key][insideKey]
+                element = self.emission[key].get(insideKey, 0)
                 if element == 0:
                     sys.stdout.write('\t' + str(element))
                 else:
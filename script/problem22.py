@@ -1,9 +1,16 @@
 import sys
+import argparse
+import itertools
+import multiprocessing
 import numpy as np
+from fastaReader import FastAreader
 from problem21 import PseudocountHMMprofile
+from problem18 import encodeSymbols
 
 class SequenceAlignment(object):
     ''''Sequence Alignment with Profile HMM Problem.
+    The alignment graph is filled one profile row at a time in log space, each row is vectorized over the
+    columns of the string, and the backtracking pointers are int8 (0 = D, 1 = M, 2 = I of the previous state).
     Attributes:
         string - observed Sequence
         theta - theta
@@ -11,173 +18,271 @@ class SequenceAlignment(object):
         alphabet - observed alphabet
         transition - transition
         emission - emission
+        band - only the columns within band of the diagonal of each row are filled (default None, all columns)
+        checkpoint - keep the graph values of every sqrt(rows) row only, and recompute the pointers of one block
+                     of rows at a time while backtracking (default False, keep the pointers of every row)
+        model - the arrays of modelArrays, when they are already known (default None, built from transition and emission)
     Methodes:
-        zeroColumns - addes zero states to the transition
-        seperateStates - Seperates states
-        bounderies - adds the boundries
-        viterbiGraph - creates the graph
+        modelArrays - the per row log transition and emission vectors
+        encodeString - the string as alphabet ids
+        bandLimits - the columns filled in a row
+        insertScan - the insertion row values
+        rowStep - fills one row of the graph
+        fillRows - fills a range of rows
         backtracking - backtrack to recover the path
     '''
-    def __init__(self, string,  theta, pseu, alphabet, transition, emission):
+    stateTypes = 'DMI'
+
+    def __init__(self, string,  theta, pseu, alphabet, transition, emission, band=None, checkpoint=False, model=None):
         self.string = string
         self.theta = theta
         self.pseu = pseu
         self.alphabet = alphabet
         self.transition = transition
         self.emission = emission
+        self.band = band
+        self.checkpoint = checkpoint
+        self.model = model
+        self.rowsNum = len(model[0]) if model is not None else len(self.emission)//3
+        self.numColumns = len(self.string) + 1
 
-    def zeroColumns(self):
-        '''Adding D0 and M0 to the transition
-        Returns:
-            transition'''
-        self.transition['D0']= {}
-        self.transition['M0']= {}
-        for i in list(self.transition.keys()):
-            self.transition['D0'][i] = 0
-            self.transition['M0'][i] = 0
-        return self.transition
-
-    def seperateStates(self):
-        '''Creating 6 matricis, 3 for backtracking, 3 for graph
+    def modelArrays(self):
+        '''Log transition and emission vectors of each row, row 0 holds S and I0 (S acts as M0, there is no D0).
         Returns:
-            6 matricis, 3 for backtracking, 3 for graph'''
-        self.zeroColumns()
-        self.rowsNum = len(self.emission)//3
-        self.numColumns = len(self.string) + 1
+            toD, toM - (rows x 3) log transitions from D, M, I of the row before into D and M of the row
+            toI - (rows x 3) log transitions from D, M, I of the row into I of the row
+            toE - the 3 log transitions from the last row into E
+            emitM, emitI - (rows x alphabet) log emissions of M and I of each row'''
+        def probability(state, nextState):
+            return self.transition.get(state, {}).get(nextState, 0)
 
-        self.matrixM = np.zeros([self.rowsNum, self.numColumns])
-        self.matrixI = np.zeros([self.rowsNum, self.numColumns])
-        self.matrixD = np.zeros([self.rowsNum, self.numColumns])
+        def name(stateType, row):
+            if row == 0:
+                return {'M': 'S', 'I': 'I0'}.get(stateType)
+            return stateType + str(row)
 
-        self.DD = np.zeros([self.rowsNum, self.numColumns], dtype= object) # for backtracking
-        self.II = np.zeros([self.rowsNum, self.numColumns], dtype= object) # for backtracking
-        self.MM = np.zeros([self.rowsNum, self.numColumns], dtype= object) # for backtracking
+        toD = np.zeros([self.rowsNum, 3])
+        toM = np.zeros([self.rowsNum, 3])
+        toI = np.zeros([self.rowsNum, 3])
+        emitM = np.zeros([self.rowsNum, len(self.alphabet)])
+        emitI = np.zeros([self.rowsNum, len(self.alphabet)])
+        for row in range(self.rowsNum):
+            for n, stateType in enumerate(self.stateTypes):
+                if row > 0:
+                    toD[row][n] = probability(name(stateType, row - 1), name('D', row))
+                    toM[row][n] = probability(name(stateType, row - 1), name('M', row))
+                toI[row][n] = probability(name(stateType, row), name('I', row))
+            if row > 0:
+                emitM[row] = [self.emission[name('M', row)].get(char, 0) for char in self.alphabet]
+            emitI[row] = [self.emission[name('I', row)].get(char, 0) for char in self.alphabet]
+        toE = np.array([probability(name(stateType, self.rowsNum - 1), 'E') for stateType in self.stateTypes])
+        with np.errstate(divide='ignore'):
+            return np.log(toD), np.log(toM), np.log(toI), np.log(toE), np.log(emitM), np.log(emitI)
 
-        return self.matrixM, self.matrixI, self.matrixD, self.MM, self.II, self.DD
+    def encodeString(self):
+        '''Encodes the string as the index of each character in alphabet.
+        Returns:
+            an int array of alphabet ids'''
+        return encodeSymbols(self.string, self.alphabet)
+
+    def bandLimits(self, row):
+        '''The columns filled in a row, all of them, or band columns either side of the diagonal.
+        Returns:
+            the first column and one past the last column'''
+        if self.band is None or self.rowsNum == 1:
+            return 0, self.numColumns
+        center = row * (self.numColumns - 1) / (self.rowsNum - 1)
+        return max(0, int(np.floor(center)) - self.band), min(self.numColumns, int(np.ceil(center)) + self.band + 1)
+
+    @staticmethod
+    def insertScan(emitted, entry, selfLoop):
+        '''Solves the insertion row I[c] = emitted[c] + max(entry[c], I[c - 1] + selfLoop) without a loop over columns.
+        A run of insertions entered at column j has the value entry[j] + sum(emitted[j..c]) + (c - j) * selfLoop,
+        so the best entry is a running maximum. A character that I can not emit breaks the runs.
+        Returns:
+            the insertion values'''
+        if np.isneginf(selfLoop):
+            return emitted + entry
+        values = np.full(len(emitted), -np.inf)
+        breaks = np.flatnonzero(np.isneginf(emitted))
+        for start, end in zip(np.concatenate(([0], breaks + 1)), np.concatenate((breaks, [len(emitted)]))):
+            if start >= end:
+                continue
+            prefix = np.cumsum(emitted[start:end])
+            steps = np.arange(end - start) * selfLoop
+            best = np.maximum.accumulate(entry[start:end] - (prefix - emitted[start:end]) - steps)
+            values[start:end] = prefix + steps + best
+        return values
 
-    def bounderies(self):
-        '''constructing the graph bounderies
+    def rowStep(self, row, previous, lo, hi):
+        '''Fills one row of the graph between columns lo and hi.
+        Arguments:
+            previous - (3 x columns) D, M, I values of the row before, None for row 0
         Returns:
-         bounderies of 6 matrices, 3 for backtracking, 3 for graph'''
-        self.seperateStates()
-        for i in range(1, self.numColumns):
-            if i == 1:
-                self.matrixI[0][1] = self.transition['S']['I0']*self.emission['I0'][self.string[0]]
-                self.II[0][1] = ('S', self.matrixI[0][1])# for backtracking
-            else:
-                self.matrixI[0][i] = self.matrixI[0][i -1]* self.transition['I0']['I0']*self.emission['I0'][self.string[i-1]]
-                self.II[0][1] = ('I0', self.matrixI[0][i])# for backtracking
-
-        for row in range(1, self.rowsNum):
-            if row == 1:
-                self.matrixD[1][0] = self.transition['S']['D1']
-                self.DD[1][0] = ('S', self.matrixD[1][0])# for backtracking
-            else:
-                self.matrixD[row][0] = self.matrixD[row -1 ][0]* self.transition['D' + str(row-1)]['D' + str(row)]
-                self.DD[row][0] = ('D' + str(row-1), self.matrixD[row][0]) #for backtracking
-        return self.matrixM, self.matrixI, self.matrixD, self.MM, self.II, self.DD
-
-    def viterbiGraph(self):
-        '''constructing the whole graph, and the backtracking matrix
+            (3 x columns) D, M, I values of the row, -inf outside lo:hi
+            (3 x hi - lo) int8 pointers to the type of the previous state, -1 where there is none'''
+        values = np.full([3, self.numColumns], -np.inf)
+        pointers = np.full([3, hi - lo], -1, dtype=np.int8)
+        start = max(lo, 1) # column 0 emits nothing
+        chars = self.stringIds[start - 1:hi - 1]
+        if row == 0:
+            values[1][0] = 0.0 # the start state S
+        else:
+            l = previous[:, lo:hi] + self.toD[row][:, None] # same column row before
+            pointers[0] = np.argmax(l, axis=0)
+            values[0][lo:hi] = l.max(axis=0)
+
+            l = previous[:, start - 1:hi - 1] + self.toM[row][:, None] # column before row before
+            pointers[1][start - lo:] = np.argmax(l, axis=0)
+            values[1][start:hi] = l.max(axis=0) + self.emitM[row][chars]
+
+        l = values[:2, start - 1:hi - 1] + self.toI[row][:2, None] # column before same row, from D or M
+        entryPointer = np.argmax(l, axis=0)
+        entry = l.max(axis=0)
+        insert = self.insertScan(self.emitI[row][chars], entry, self.toI[row][2])
+        values[2][start:hi] = insert
+        fromInsert = np.concatenate(([-np.inf], insert[:-1])) + self.toI[row][2] > entry # ties go to D and M
+        pointers[2][start - lo:] = np.where(fromInsert, 2, entryPointer)
+        return values, pointers
+
+    def fillRows(self, firstRow, lastRow, previous=None, keepPointers=True, blockSize=0):
+        '''Fills rows firstRow to lastRow - 1.
+        Arguments:
+            previous - the values of row firstRow - 1
+            keepPointers - keep the pointers of the rows
+            blockSize - keep the values of every row closing a block of blockSize rows (default 0, none)
         Returns:
-            6 matrices, 3 for backtracking, 3 for graph'''
-        self.bounderies()
-        for row in range(1, self.rowsNum):
-            for column in range(1, self.numColumns):
-                if row == 1 and column == 1:
-                    self.matrixD[1][1] =self.matrixI[0][1]*self.transition['I0']['D1']
-                    self.matrixM[1][1] = self.transition['S']['M1']*self.emission['M1'][self.string[0]]
-                    self.matrixI[1][1] = self.matrixD[1][0]*self.transition['D1']['I1']*self.emission['I1'][self.string[0]]
-
-                    self.DD[1][1] =('I0',self.matrixD[1][1])#for backtracking
-                    self.MM[1][1] =('S',self.MM[1][1])#for backtracking
-                    self.II[1][1] = ('D1',self.II[1][1])#for backtracking
-
-                else:
-                    l = (self.matrixD[row-1][column]*self.transition['D' +  str(row -1)]['D' + str(row)], # same column row before
-                         self.matrixM[row-1][column]*self.transition['M' +  str(row -1)]['D' + str(row)],
-                         self.matrixI[row-1][column]*self.transition['I' +  str(row -1)]['D' + str(row)])
-                    n = ['D' +  str(row -1),'M' +  str(row -1), 'I' +  str(row -1)]
-                    p = np.argmax(l)
-                    q = n[p]
-                    self.matrixD[row][column] = l[p]
-                    self.DD[row][column]= (q, l[p])#for backtracking
-
-
-                    l = (self.matrixD[row-1][column -1]*self.transition['D' +  str(row -1)]['M' + str(row)]* self.emission['M' + str(row)][self.string[column -1]], # same column row before
-                         self.matrixM[row-1][column -1]*self.transition['M' +  str(row -1)]['M' + str(row)]* self.emission['M' + str(row)][self.string[column -1]],
-                         self.matrixI[row-1][column -1]*self.transition['I' +  str(row -1)]['M' + str(row)]* self.emission['M' + str(row)][self.string[column -1]])
-                    n = ['D' +  str(row -1), 'M' +  str(row -1), 'I' +  str(row -1)]
-                    p = np.argmax(l)
-                    q = n[p]
-                    self.matrixM[row][column] = l[p]
-                    self.MM[row][column] = (q, l[p])#for backtracking
-
-
-                    l = (self.matrixD[row][column -1]*self.transition['D' +  str(row)]['I' + str(row)]* self.emission['I' + str(row)][self.string[column -1]], # same column row before
-                         self.matrixM[row][column -1]*self.transition['M' +  str(row)]['I' + str(row)]* self.emission['I' + str(row)][self.string[column -1]],
-                         self.matrixI[row][column -1]*self.transition['I' +  str(row)]['I' + str(row)]* self.emission['I' + str(row)][self.string[column -1]])
-                    n = ['D' +  str(row), 'M' +  str(row), 'I' +  str(row)]
-                    p = np.argmax(l)
-                    q = n[p]
-                    self.matrixI[row][column] = l[p]
-                    self.II[row][column] = (q, l[p])#for backtracking
-
-        return self.matrixD,self.matrixM, self.matrixI, self.DD, self.MM,self.II
+            a list of (first column, pointers) per row, the values of the last row, and {row: values} of the block ends'''
+        pointers, checkpoints = [], {}
+        for row in range(firstRow, lastRow):
+            lo, hi = self.bandLimits(row)
+            previous, rowPointers = self.rowStep(row, previous, lo, hi)
+            if keepPointers:
+                pointers.append((lo, rowPointers))
+            if blockSize and (row + 1) % blockSize == 0:
+                checkpoints[row] = previous
+        return pointers, previous, checkpoints
 
     def backtracking(self):
         '''An optimal hidden path emitting Text in HMM(Alignment,θ,σ).
         Returns:
-            hiddem path'''
-        self.viterbiGraph()
-        orderedList = []
+            hiddem path, from the last state to the first'''
+        if self.model is None:
+            self.model = self.modelArrays()
+        self.toD, self.toM, self.toI, self.toE, self.emitM, self.emitI = self.model
+        self.stringIds = self.encodeString()
+        lastRow, column = self.rowsNum - 1, self.numColumns - 1
+        blockSize = int(np.ceil(np.sqrt(self.rowsNum))) if self.checkpoint else 0
+        pointers, last, checkpoints = self.fillRows(0, self.rowsNum, keepPointers=not self.checkpoint, blockSize=blockSize)
+
         # first I find the state before the end state
-        l = (self.matrixD[self.rowsNum -1][self.numColumns -1]*self.transition['D' +  str(self.rowsNum -1)]['E'],
-             self.matrixM[self.rowsNum -1][self.numColumns -1]*self.transition['M' +  str(self.rowsNum -1)]['E'],
-             self.matrixI[self.rowsNum -1][self.numColumns -1]*self.transition['I' +  str(self.rowsNum -1)]['E'])
-        n = ['D' +  str(self.rowsNum -1), 'M' +  str(self.rowsNum -1), 'I' +  str(self.rowsNum -1)]
-        p = np.argmax(l)
-        q = n[p]
-        lastProb = l[p]
-        prevState = q
-
-        orderedList.append(prevState)
-        #prevProb = lastProb
-
-        column = len(self.string)
-        row = self.rowsNum -1
-
-        # backtracking
-        while column != 0:
-            if 'M' in prevState:
-                if type(self.MM[row][column]) is not tuple:
-                    break
-                prevState = self.MM[row][column][0]
-                if prevState == 'S':
-                    break
-                row =int(prevState[1:])
-                column -=1
-
-            elif 'D' in prevState:
-                if type(self.DD[row][column]) is not tuple:
-                    break
-                prevState = self.DD[row][column][0]
-                if prevState == 'S':
-                    break
-                row =int(prevState[1:])
-
-            elif 'I' in prevState:
-                if type(self.II[row][column]) is not tuple:
-                    break
-                prevState = self.II[row][column][0]
-                if prevState == 'S':
-                    break
-                row =int(prevState[1:])
-                column -=1
-            orderedList.append(prevState)
+        l = last[:, column] + self.toE
+        if np.isneginf(l.max()):
+            raise ValueError('the string has no alignment to the profile' + (' inside the band' if self.band is not None else ''))
+        stateType, row = int(np.argmax(l)), lastRow
+        blockFirst = self.rowsNum if self.checkpoint else 0
 
+        # backtracking, until M of row 0 which is S
+        orderedList = []
+        while row > 0 or stateType != 1:
+            if row < blockFirst: # recompute the pointers of the block of rows holding this row
+                blockFirst = row // blockSize * blockSize
+                pointers, blockLast, blockCheckpoints = self.fillRows(blockFirst, min(blockFirst + blockSize, self.rowsNum), checkpoints.get(blockFirst - 1))
+            orderedList.append(self.stateTypes[stateType] + str(row))
+            lo, rowPointers = pointers[row - blockFirst]
+            previousType = int(rowPointers[stateType][column - lo])
+            if stateType != 2:
+                row -= 1
+            if stateType != 0:
+                column -= 1
+            stateType = previousType
         return orderedList
 
+class ProfileAligner(object):
+    '''Aligns many strings to one profile HMM, the profile arrays are built once and shared by every alignment.
+    Attributes:
+        alphabet - observed alphabet
+        band - band of SequenceAlignment (default None)
+        checkpoint - checkpoint of SequenceAlignment (default False)
+        model - the profile arrays of SequenceAlignment.modelArrays
+    Methodes:
+        align - the hidden path of one string
+        alignAll - the hidden paths of (name, string) pairs, in input order
+        writeAlignments - writes the hidden paths as they are found
+    '''
+    def __init__(self, transition, emission, alphabet, band=None, checkpoint=False):
+        self.alphabet = alphabet
+        self.band = band
+        self.checkpoint = checkpoint
+        self.model = SequenceAlignment(string = '', theta = None, pseu = None, alphabet = alphabet, transition = transition, emission = emission).modelArrays()
+
+    def align(self, string):
+        '''Aligns one string to the profile.
+        Returns:
+            the hidden path, from the first state to the last'''
+        j = SequenceAlignment(string = string, theta = None, pseu = None, alphabet = self.alphabet, transition = None, emission = None,
+                              band = self.band, checkpoint = self.checkpoint, model = self.model)
+        return j.backtracking()[::-1]
+
+    def alignAll(self, sequences, workers=1, chunkSize=64):
+        '''Aligns (name, string) pairs, in a process pool when workers > 1. The pool is given one window of
+        workers * chunkSize pairs at a time, and the window is aligned and yielded before the next one is read,
+        so at most one window of reads is held in memory however long the input is.
+        Returns:
+            a generator of (name, hidden path), the path is None when the string can not be aligned'''
+        if workers > 1:
+            sequences = iter(sequences)
+            with multiprocessing.Pool(workers, initializer=setWorkerAligner, initargs=(self,)) as pool:
+                while True:
+                    window = list(itertools.islice(sequences, workers * chunkSize)) # one chunk per worker
+                    if not window:
+                        break
+                    for result in pool.imap(alignWorkerRead, window, chunksize=chunkSize):
+                        yield result
+        else:
+            for read in sequences:
+                yield alignRead(self, read)
+
+    def writeAlignments(self, sequences, outFile, workers=1, chunkSize=64):
+        '''Writes name, tab, hidden path per line as the alignments come back,
+        a string that can not be aligned is reported on STDERR.
+        Returns:
+            the number of aligned strings'''
+        aligned = 0
+        for name, path in self.alignAll(sequences, workers, chunkSize):
+            if path is None:
+                sys.stderr.write('could not align %s\n' % name)
+                continue
+            outFile.write(name + '\t' + ' '.join(path) + '\n')
+            aligned += 1
+        return aligned
+
+
+workerAligner = None
+
+
+def setWorkerAligner(aligner):
+    '''Stores the aligner, with its log transition and emission vectors, in a new worker process.
+    The reads are then sent without the profile.'''
+    global workerAligner
+    workerAligner = aligner
+
+
+def alignWorkerRead(read):
+    '''Aligns one (name, string) pair in a worker process.'''
+    return alignRead(workerAligner, read)
+
+
+def alignRead(aligner, read):
+    '''Aligns one (name, string) pair.
+    Returns:
+        (name, hidden path), the path is None when the string has characters outside the alphabet or no alignment'''
+    name, string = read
+    try:
+        return name, aligner.align(string)
+    except ValueError:
+        return name, None
+
 class RosalindParse(object):
 
     def __init__(self, inputFile):
@@ -194,12 +299,22 @@ class RosalindParse(object):
         return string, theta, observations, observedChar, pseu
 
 def main():
+    parser = argparse.ArgumentParser(description="alignment to a profile HMM, the Rosalind input is read from STDIN")
+    parser.add_argument('-i', '--inputFile', default=None, help='fasta of strings to align instead of the Rosalind string, written as name, tab, hidden path')
+    parser.add_argument('-w', '--workers', type=int, default=1, help='number of aligning processes')
+    parser.add_argument('-b', '--band', type=int, default=None, help='only fill the columns within band of the diagonal')
+    parser.add_argument('-c', '--checkpoint', action='store_true', help='keep every sqrt(rows) graph row only, recompute the pointers while backtracking')
+    args = parser.parse_args()
     fr = RosalindParse(sys.stdin)
     string, theta, observations, observedChar, pseu= fr.rosalidParse()
     h = PseudocountHMMprofile(theta = theta, observations = observations, observedChar = observedChar, pseu = pseu)
     transition = h.transitionProb()
     emission = h.emissionProb()
-    j = SequenceAlignment(string= string, pseu= pseu, theta= theta, alphabet =  observedChar, transition= transition, emission= emission)
+    if args.inputFile is not None:
+        aligner = ProfileAligner(transition = transition, emission = emission, alphabet = observedChar, band = args.band, checkpoint = args.checkpoint)
+        aligner.writeAlignments(FastAreader(args.inputFile).readFasta(), sys.stdout, args.workers)
+        return
+    j = SequenceAlignment(string= string, pseu= pseu, theta= theta, alphabet =  observedChar, transition= transition, emission= emission, band = args.band, checkpoint = args.checkpoint)
     b = j.backtracking()
     sys.stdout.write(' '.join(map(str, b[::-1])) + '\n')
 
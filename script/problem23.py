@@ -1,6 +1,7 @@
 import numpy as np
 import itertools
 import sys
+from problem18 import encodeSymbols
 
 class RosalindParse(object):
     '''Parsing the Rosalind input.
@@ -39,6 +40,10 @@ class ParaEstimation(object):
         emissionBackbone -creates the emission backbone
         possibleCombinations - finds all possible combinations between states
         count - counts the number of substrings in a string
+        encode - encodes a sequence as ids into an alphabet
+        transitionCounts - the transition counts array
+        emissionCounts - the emission counts array
+        normalize - turns count rows into probability rows
         emission - creates the transition
         transition - creates the emission
     '''
@@ -84,25 +89,55 @@ class ParaEstimation(object):
         comb = [''.join(i) for i in itertools.product(self.states, repeat = 2)]
         return comb
 
+    def encode(self, sequence, alphabet):
+        '''Encodes a sequence as the index of each character in alphabet, an int array is returned as is.
+        Returns:
+            an int array of ids'''
+        if isinstance(sequence, np.ndarray):
+            return sequence
+        return encodeSymbols(sequence, alphabet)
+
+    def transitionCounts(self):
+        '''Counts every transition of stateSeq in one pass, a pair is counted as previous * len(states) + next.
+        Returns:
+            a (states x states) array of counts'''
+        stateIds = self.encode(self.stateSeq.strip() if isinstance(self.stateSeq, str) else self.stateSeq, self.states)
+        numStates = len(self.states)
+        counts = np.bincount(stateIds[:-1] * numStates + stateIds[1:], minlength=numStates * numStates)
+        return counts.reshape(numStates, numStates).astype(float)
+
+    def emissionCounts(self):
+        '''Counts every (state, emitted character) pair in one pass.
+        Returns:
+            a (states x observedAlphabet) array of counts'''
+        stateIds = self.encode(self.stateSeq.strip() if isinstance(self.stateSeq, str) else self.stateSeq, self.states)
+        charIds = self.encode(self.observedSeq, self.observedAlphabet)[:len(stateIds)]
+        numChars = len(self.observedAlphabet)
+        counts = np.bincount(stateIds * numChars + charIds, minlength=len(self.states) * numChars)
+        return counts.reshape(len(self.states), numChars).astype(float)
+
+    @staticmethod
+    def normalize(counts):
+        '''Divides each row by its sum, a row with no counts gets the uniform probability.
+        Returns:
+            the counts array, normalised in place'''
+        s = counts.sum(axis=1, keepdims=True)
+        np.divide(counts, s, out=counts, where=s != 0)
+        counts[s[:, 0] == 0] = 1 / counts.shape[1]
+        return counts
+
+    @staticmethod
+    def probabilityDict(probabilities, states, alphabet):
+        '''Converts a (states x alphabet) array of probabilities to a dict of dict.
+        Returns:
+            the probabilities keyed by state, then by character of alphabet'''
+        return {state : dict(zip(alphabet, map(float, probabilities[n]))) for n, state in enumerate(states)}
+
     def emission(self):
         '''Create the emission probability, in dict of dict structure.
         Returns:
             the emission probability'''
-        emission = self.emissionBackbone() # getting the backbone
-        for i in range(len(self.stateSeq.strip())):
-            ob = self.observedSeq[i]
-            st = self.stateSeq[i]
-            emission[st][ob] += 1
-
-        for k, v in emission.items():
-            su = sum(list(v.values()))
-            if su != 0: # if the sum is not zero
-                for j,p in v.items():
-                    emission[k][j] = float(p/su) # if the sum is not zero divide each element by the sum
-            else:# if the sum is zero
-                for j,p in v.items():
-                    emission[k][j] = float(1/len(self.observedAlphabet)) # if the sum is zero just devide the probability by the number of observed alphabets
-        return emission
+        return self.probabilityDict(self.normalize(self.emissionCounts()), self.states, self.observedAlphabet)
 
     def count(self,string, substring):
         '''Counting the number of substrings in a string.
@@ -116,28 +151,10 @@ class ParaEstimation(object):
         return count
 
     def transition(self):
-        '''Calculating the emission probability, dict of dict.
+        '''Calculating the transition probability, dict of dict.
         Returns:
-            the emission probability'''
-        comb = self.possibleCombinations() # all possible combinations between states
-        transition = self.transitionBackbone() # getting the transition backbone
-
-        stateCount = {state : 0  for state in self.states} # creating a dictionary od states
-
-        for state in self.states:
-            stateCount[state] = self.count(self.stateSeq[:-1], state) # adding the count of number of times that each state occured in the observed stateSeq
-
-        for combTrans in comb:
-            transition[combTrans[0]][combTrans[1]] += float(self.count(self.stateSeq, combTrans)) # counting the number of times that each transition happend in the stateSeq
-
-        for k,v in transition.items(): # for each key and value in the transition
-            if sum(list(v.values())) != 0: # if the sum of values in the v at not zero
-                for kk,vv in v.items():
-                    transition[k][kk] = vv/stateCount[k] # do the divission to find the probability
-            elif sum(list(v.values())) == 0:# if the sum of values in the v at not zero
-                for kk,vv in v.items():
-                    transition[k][kk] = 1/len(self.states) # just devide by the number of states
-        return transition
+            the transition probability'''
+        return self.probabilityDict(self.normalize(self.transitionCounts()), self.states, self.states)
 
 
 
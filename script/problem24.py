@@ -2,6 +2,7 @@ from problem23 import ParaEstimation
 from problem23 import OutputFormat
 from problem18 import ViterbiPath
 import sys
+import multiprocessing
 import numpy as np
 
 
@@ -70,45 +71,114 @@ class ViterbiLearning(object):
     '''Viterbi Learning
     Attributes:
         numIteration
-        observedSeq
+        observedSeq - the observed sequence, or a list of observed sequences trained together
         observedAlphabet
         states
         initTransition - initial transition
         initEmission - initial emission
+        workers - number of processes decoding the sequences (default 1, no pool)
+        iterations - the number of iterations run, fewer than numIteration if the paths stopped changing
     Methods:
+        decode - the Viterbi path of every sequence as state ids
+        pathCounts - transition and emission counts of the decoded paths
+        pathParameters - the transition and emission dicts of the path counts
         viterbilearning - outputs the final tranisiton and emission matricis'''
-    def __init__(self, numIteration,observedSeq,observedAlphabet,states, initTransition, initEmission ):
+    def __init__(self, numIteration,observedSeq,observedAlphabet,states, initTransition, initEmission, workers=1 ):
         self.numIteration = numIteration
         self.observedSeq = observedSeq
         self.observedAlphabet = observedAlphabet
         self.states = states
         self.initTransition = initTransition
         self.initEmission = initEmission
+        self.workers = workers
+        self.sequences = [observedSeq] if isinstance(observedSeq, str) else list(observedSeq)
+        self.iterations = 0
+
+    def decode(self, transition, emission, pool=None):
+        '''Decodes every sequence with the current parameters.
+        Returns:
+            a list of int arrays of state ids'''
+        tasks = [(index, transition, emission) for index in range(len(self.sequences))]
+        if pool is not None:
+            return pool.map(decodeWorkerSequence, tasks)
+        return [decodeSequence(self, task) for task in tasks]
+
+    def pathCounts(self, paths, observations):
+        '''Counts the transitions and emissions of the decoded paths with ParaEstimation, summed over the sequences.
+        Returns:
+            (states x states) transition counts, (states x observedAlphabet) emission counts'''
+        transitionCounts = np.zeros((len(self.states), len(self.states)))
+        emissionCounts = np.zeros((len(self.states), len(self.observedAlphabet)))
+        for path, observation in zip(paths, observations):
+            x = ParaEstimation(observedSeq = observation, observedAlphabet = self.observedAlphabet, stateSeq = path, states = self.states)
+            transitionCounts += x.transitionCounts()
+            emissionCounts += x.emissionCounts()
+        return transitionCounts, emissionCounts
+
+    def pathParameters(self, transitionCounts, emissionCounts):
+        '''Estimates the parameters from the path counts with ParaEstimation, a state that is never left gets
+        uniform transitions and a state that never emits gets uniform emissions (problem26.countsToParameters
+        leaves such rows at 0).
+        Returns:
+            transition and emission dicts'''
+        transition = ParaEstimation.probabilityDict(ParaEstimation.normalize(transitionCounts), self.states, self.states)
+        emission = ParaEstimation.probabilityDict(ParaEstimation.normalize(emissionCounts), self.states, self.observedAlphabet)
+        return transition, emission
 
     def viterbilearning(self):
         ''' A matrix of transition probabilities and a matrix of emission probabilities.
+        Stops before numIteration once an iteration decodes the same paths as the one before,
+        since the parameters estimated from them can not change anymore.
         Returns:
             transition - transition probabilities
             emission - emission probabilities'''
-        for i in range(self.numIteration + 1):
-            if i == 0:
-                transition = self.initTransition # getting the initial transition
-                emission = self.initEmission # getting the initial emission
-                #here I'm finding the viterbi path based on the initial transition and emission dicts
-                vp = ViterbiPath(observation = self.observedSeq , transition = transition, emission= emission, states = self.states, observedChar = self.observedAlphabet)
-                transition = vp.transition # the new tranisiton
-                emission = vp.emission # the new emission
-            else:
-                # here I'm using the previouse transition and emission to find the viterbi path
-                vp = ViterbiPath(observation = self.observedSeq , transition = transition, emission= emission, states = self.states, observedChar = self.observedAlphabet)
-                stateSeq = vp.viterbiPath() # finding the new stateSeq
-                # getting the parameter Estimation
-                x = ParaEstimation(observedSeq = self.observedSeq , observedAlphabet= self.observedAlphabet, stateSeq= stateSeq, states= self.states)
-                emission = x.emission() # new emission
-                transition = x.transition() # new transition
+        transition = self.initTransition # getting the initial transition
+        emission = self.initEmission # getting the initial emission
+        observations = [ViterbiPath(observation = sequence, transition = transition, emission = emission, states = self.states, observedChar = self.observedAlphabet).encodeObservation() for sequence in self.sequences]
+        previousPaths = None
+        self.iterations = 0
+        pool = multiprocessing.Pool(self.workers, initializer=setWorkerLearning, initargs=(self,)) if self.workers > 1 else None
+        try:
+            for i in range(self.numIteration):
+                # here I'm using the previouse transition and emission to find the viterbi paths
+                paths = self.decode(transition, emission, pool)
+                if previousPaths is not None and all(np.array_equal(path, previous) for path, previous in zip(paths, previousPaths)):
+                    break
+                transition, emission = self.pathParameters(*self.pathCounts(paths, observations))
+                previousPaths = paths
+                self.iterations += 1
+        finally:
+            if pool is not None:
+                pool.close()
+                pool.join()
         return transition, emission
 
 
+workerLearning = None
+
+
+def setWorkerLearning(learning):
+    '''Stores the learner and its sequences in a new worker process. In each iteration a task is then
+    a sequence index plus the current transition and emission.'''
+    global workerLearning
+    workerLearning = learning
+
+
+def decodeWorkerSequence(task):
+    '''Decodes one sequence in a worker process.'''
+    return decodeSequence(workerLearning, task)
+
+
+def decodeSequence(learning, task):
+    '''The Viterbi path of learning.sequences[index] under one model.
+    Returns:
+        an int array of state ids'''
+    index, transition, emission = task
+    vp = ViterbiPath(observation = learning.sequences[index], transition = transition, emission = emission, states = learning.states, observedChar = learning.observedAlphabet)
+    path, logProb = vp.logViterbi()
+    return np.asarray(path)
+
+
 
 def main():
     '''Process the input file, create an object of the class, and create the output'''
@@ -1,5 +1,6 @@
 import sys
 import numpy as np
+from problem18 import encodeSymbols, probabilityArrays
 
 class SoftDecoding(object):
     def __init__(self, observation, transition, emission, states, observedChar ):
@@ -11,7 +12,9 @@ class SoftDecoding(object):
             emission - emission matrix
             transition - transition matrix
         Methods:
-            forwardBackward - returns the probability Pr(x) that the HMM emits x.
+            modelArrays - transition and emission arrays indexed by state/symbol ids
+            encodeObservation - the observation as an array of symbol ids
+            scaledForwardBackward - forward and backward matrices with per column scaling, and log Pr(x)
             softDecoding - The outcome likelihood for pr(x)'''
         self.observation = observation
         self.transition = transition
@@ -19,47 +22,70 @@ class SoftDecoding(object):
         self.observedChar = observedChar
         self.states = states
 
-    def forwardBackward(self):
-        '''Returns the probability Pr(x) that the HMM emits x.
+    def modelArrays(self):
+        '''Converts the transition and emission dicts to arrays.
         Returns:
-            forward and backward matrices'''
-        forwardProb = [{state : {"currentProb" : (1.0 / len(self.states)) * self.emission[state][self.observation[0]]} for state in self.states}]
-        for characterIndex in range(1, len(self.observation)):
-            forwardProb.append({}) #for each position append a new dict to the forwardProb
-            for state in self.states:
-                SUM = 0
-                for prev_state in self.states:
-                    prob = (forwardProb[characterIndex-1][prev_state]["currentProb"] * self.transition[prev_state][state] * self.emission[state][self.observation[characterIndex]])
-                    SUM += prob
-                forwardProb[characterIndex][state] = {"currentProb" : SUM}
+            transition - (states x states) array, row is the previous state
+            emission - (states x observedChar) array'''
+        return probabilityArrays(self.transition, self.emission, self.states, self.observedChar)
 
+    def encodeObservation(self):
+        '''Encodes the observation as symbol ids, the index of each character in observedChar.
+        Returns:
+            an int array of symbol ids'''
+        return encodeSymbols(self.observation, self.observedChar)
+
+    def scaledForwardBackward(self, forward=None, backward=None, scale=None, model=None):
+        '''Forward-backward with a scaling factor per column, so long observations do not underflow.
+        Each forward column is divided by its sum (the scale), and each backward column by the scale
+        of the next column, which makes forward * backward the posterior of each state.
+        Arguments:
+            forward, backward - optional (len(observation) x states) float64 buffers to fill
+            scale - optional len(observation) float64 buffer to fill
+            model - (transition, emission, observation) arrays, when they are already known (default None,
+                    built from the dicts and the observation string)
+        Returns:
+            forward - scaled forward matrix, each row sums to 1
+            backward - scaled backward matrix
+            scale - the scaling factors
+            logLikelihood - log Pr(x), the sum of the log scaling factors'''
+        if model is None:
+            model = self.modelArrays() + (self.encodeObservation(),)
+        transition, emission, observation = model
+        numChars, numStates = len(observation), len(self.states)
+        if forward is None:
+            forward = np.empty((numChars, numStates))
+        if backward is None:
+            backward = np.empty((numChars, numStates))
+        if scale is None:
+            scale = np.empty(numChars)
+        emitted = emission.T[observation] # emitted[i] is the emission probability of character i by each state
+        column = np.empty(numStates)
 
-        backwardProb = [{state : {"currentProb" : 1.0} for state in self.states}]
-        for characterIndex in range(len(self.observation)-2, -1,-1):
-            backwardProb.append({}) #for each position append a new dict to the backwardProb
-            for state in self.states:
-                SUM = 0
-                for prev_state in self.states:
-                    prob = (backwardProb[-2][prev_state]["currentProb"] * self.transition[state][prev_state] * self.emission[prev_state][self.observation[characterIndex + 1]])
-                    SUM += prob
-                backwardProb[-1][state] = {"currentProb" : SUM}
-        return forwardProb, backwardProb[::-1]
+        np.multiply(1.0 / numStates, emitted[0], out=column)
+        scale[0] = column.sum()
+        np.divide(column, scale[0], out=forward[0])
+        for characterIndex in range(1, numChars):
+            np.dot(forward[characterIndex - 1], transition, out=column)
+            column *= emitted[characterIndex]
+            scale[characterIndex] = column.sum()
+            np.divide(column, scale[characterIndex], out=forward[characterIndex])
 
+        backward[-1] = 1.0
+        for characterIndex in range(numChars - 2, -1, -1):
+            np.multiply(emitted[characterIndex + 1], backward[characterIndex + 1], out=column)
+            np.dot(transition, column, out=backward[characterIndex])
+            backward[characterIndex] /= scale[characterIndex + 1]
+        return forward, backward, scale, np.log(scale).sum()
 
     def softDecoding(self):
-        forward, backward = self.forwardBackward()
-        t = []
-        for i, j in enumerate(forward):
-            h = backward[i]
-            total = 0
-            B = []
-            for state in self.states:
-                total += j[state]['currentProb']*h[state]['currentProb']
-            for state in self.states:
-                A = j[state]['currentProb']*h[state]['currentProb']/total
-                B.append(A)
-            t.append(B)
-        return t
+        '''The posterior probability of each state at each position.
+        Returns:
+            a (len(observation) x states) matrix, each row sums to 1'''
+        forward, backward, scale, logLikelihood = self.scaledForwardBackward()
+        posterior = forward * backward
+        posterior /= posterior.sum(axis=1, keepdims=True)
+        return posterior
 
 def main():
     '''Process the input file, create an object of the class, and create the output'''
@@ -1,130 +1,323 @@
 import sys
+import time
+import argparse
+import multiprocessing
 import numpy as np
 from problem25 import SoftDecoding
+from fastaReader import FastAreader
 
 
 class BaumWelch(object):
     ''' Learning the emission and transition using BaumWelch algorithem.
     Attributes:
         states - states
-        forwardMatrix - forwardMatrix
-        backwardMatrix - backwardMatrix
+        forwardMatrix - forward matrix, (len(observation) x states) array from SoftDecoding.scaledForwardBackward
+        backwardMatrix - backward matrix, (len(observation) x states) array
         observation - observed sequence
         transition - transition
         emission - emission
-        nodeRes - node responsiblity metrix
+        nodeRes - node responsiblity metrix, computed from the forward and backward matrices if None
         observedChar - observed characters
+        scale - the scaling factors of the forward and backward matrices (default None, unscaled matrices)
+        model - the arrays of modelArrays, when they are already known (default None, built from transition and emission)
     Methodes:
-        edgeWeight - finds the edge weights
-        forwardSink - find the forward sink values
-        edgeResponsibility - finds the edge responsiblity matrix
+        modelArrays - the transition and emission arrays and the encoded observation
+        nodeResponsibility - finds the node responsiblity matrix
+        edgeResponsibility - finds the expected transition counts
+        emissionResponsibility - finds the expected emission counts
         redefineParameters - redefins transition and emission parameters
-        find - finds the index of a character in a string
     '''
 
-    def __init__(self,forwardMatrix, backwardMatrix, states, observation, transition, emission, nodeRes, observedChar):
+    def __init__(self,forwardMatrix, backwardMatrix, states, observation, transition, emission, nodeRes, observedChar, scale=None, model=None):
         self.states = states
-        self.forwardMatrix = forwardMatrix
-        self.backwardMatrix = backwardMatrix
+        self.forwardMatrix = np.asanyarray(forwardMatrix, dtype=float)
+        self.backwardMatrix = np.asanyarray(backwardMatrix, dtype=float)
         self.observation = observation
         self.transition = transition
         self.emission = emission
         self.nodeRes = nodeRes
         self.observedChar = observedChar
+        self.scale = np.ones(len(observation)) if scale is None else scale
+        self.model = model
 
-    def edgeWeight(self):
-        '''finds the edge weights.
+    def modelArrays(self):
+        '''The transition and emission arrays, and the observation as symbol ids.
         Returns:
-            A list of dictionaries each having the edge probabilities'''
-        edgeProb = [{}]
-        for characterIndex in range(1, len(self.observation)):
-            edgeProb.append({})
-            for state in self.states:
-                for nextState in self.states:
-                    edgeProb[characterIndex][state + nextState] = self.transition[state][nextState] * self.emission[nextState][self.observation[characterIndex]]
-        return edgeProb
-
-    def forwardSink(self):
-        '''Finding the forwardSink values.
-        Returns :
-            a list containg the forward sink values'''
+            transition - (states x states) array, row is the previous state
+            emission - (states x observedChar) array
+            observation - int array of symbol ids'''
+        if self.model is not None:
+            return self.model
+        decoding = SoftDecoding(observation = self.observation, transition = self.transition, emission = self.emission, states = self.states, observedChar = self.observedChar)
+        transition, emission = decoding.modelArrays()
+        return transition, emission, decoding.encodeObservation()
+
+    def nodeResponsibility(self, out=None):
+        '''Finding the node responsiblity values, forward * backward normalised at each position.
+        Arguments:
+            out - optional (len(observation) x states) buffer to fill
+        Returns:
+            a (len(observation) x states) array, each row sums to 1'''
+        if self.nodeRes is not None:
+            return np.asanyarray(self.nodeRes, dtype=float)
+        nodeRes = np.multiply(self.forwardMatrix, self.backwardMatrix, out=out)
+        nodeRes /= nodeRes.sum(axis=1, keepdims=True)
+        return nodeRes
+
+    def edgeResponsibility(self, transition, emission, observation, weighted=None):
+        '''Finding the edge responsiblity values summed over the positions.
+        The responsibility of edge (state, nextState) between position i and i+1 is
+        forward[i][state] * transition[state][nextState] * emission[nextState][x[i+1]] * backward[i+1][nextState] / (scale[i+1] * Pr(x)),
+        so the sum over i is one matrix product of the forward matrix and the weighted backward matrix.
+        Arguments:
+            weighted - optional (len(observation) - 1 x states) buffer for the weighted backward matrix
+        Returns:
+            a (states x states) array of expected transition counts'''
         forward, backward = self.forwardMatrix, self.backwardMatrix
-        t = []
-        for i in range(len(forward)):
-            total = 0
-            for state in self.states:
-                total += forward[i][state]['currentProb']*backward[i][state]['currentProb']
-            t.append(total)
-        return t
-
-    def edgeResponsibility(self):
-        '''Finding the edge responsiblity values.
+        fSink = np.dot(forward[-1], backward[-1]) # Pr(x) in the units of the forward and backward matrices
+        weighted = np.multiply(emission.T[observation[1:]], backward[1:], out=weighted) # emission of the next character times its backward value
+        weighted /= self.scale[1:, None]
+        return np.dot(forward[:-1].T, weighted) * transition / fSink
+
+    def emissionResponsibility(self, nodeRes, observation):
+        '''Finding the node responsiblity values summed per observed character.
         Returns:
-            edge responsiblity values'''
-        fSink = self.forwardSink() # the forward sink value
-        edgeRes = [] # edge responsibility list
-        edgeProb = self.edgeWeight()[1:] # get the esdge probability values
-        for i in range(len(edgeProb)):
-            tot= {}
-            for edgeName, edgeW in edgeProb[i].items():
-                state, nextState = edgeName[0], edgeName[1]
-                mult = self.forwardMatrix[i][state]['currentProb'] * self.backwardMatrix[i+1][nextState]['currentProb'] * edgeW/fSink[i]
-                tot[state + nextState] = mult
-            edgeRes.append(tot)
-        return edgeRes
-
-    def find(self, x, ch):
-        '''Finds a list of all indexes that a character has occures ina string.
+            a (states x observedChar) array of expected emission counts'''
+        return np.array([np.bincount(observation, weights=nodeRes[:, n], minlength=len(self.observedChar)) for n in range(len(self.states))])
+
+    def expectedCounts(self, weighted=None, nodeRes=None):
+        '''The expected transition and emission counts of the observation.
+        Arguments:
+            weighted, nodeRes - optional buffers for edgeResponsibility and nodeResponsibility
         Returns:
-            a list with all the indexes that a character has occured in a string'''
-        return [i for i, j in enumerate(x) if j == ch]
+            (states x states) transition counts, (states x observedChar) emission counts'''
+        transition, emission, observation = self.modelArrays()
+        transitionCounts = self.edgeResponsibility(transition, emission, observation, weighted)
+        emissionCounts = self.emissionResponsibility(self.nodeResponsibility(nodeRes), observation)
+        return transitionCounts, emissionCounts
 
-    def redefineParameters(self):
+    def redefineParameters(self, weighted=None, nodeRes=None):
         '''Redefining parameters (transition and emission).
+        Arguments:
+            weighted, nodeRes - optional buffers for edgeResponsibility and nodeResponsibility
         Returns:
             the new emission and transition dicts'''
-        edgeRes = self.edgeResponsibility() # get the edge responsibility values
-        newTransition = {state : {} for state in self.states} # the new transitin , dict of dict structure
-        for edgeValue in edgeRes: # for each edge value in the edgeRes
-            for k,v in edgeValue.items(): # for key and value in the edge values
-                start = k[0] # the start of the edge
-                end = k[1] # the end of the edge
-                if end not in newTransition[start]:
-                    newTransition[start][end] = v
-                else:
-                    newTransition[start][end] += v # counting
-        # making the probability
-        for k,v in newTransition.items():
-            s = sum(list(v.values()))
-            for i,j in v.items():
-                if s != 0:
-                    newTransition[k][i] = j/s
+        transitionCounts, emissionCounts = self.expectedCounts(weighted, nodeRes)
+        return countsToParameters(transitionCounts, emissionCounts, self.states, self.observedChar)
+
+
+def normalizeCounts(transitionCounts, emissionCounts):
+    '''Normalises expected counts in place to transition and emission arrays, a row with no counts is left at 0.
+    Returns:
+        the transition and emission arrays'''
+    for counts in (transitionCounts, emissionCounts):
+        s = counts.sum(axis=1, keepdims=True)
+        np.divide(counts, s, out=counts, where=s != 0)
+    return transitionCounts, emissionCounts
+
+
+def parameterDicts(transition, emission, states, observedChar):
+    '''Converts transition and emission arrays to dicts.
+    Returns:
+        the transition and emission dicts'''
+    newTransition = {state : dict(zip(states, map(float, transition[n]))) for n, state in enumerate(states)}
+    newEmission = {state : dict(zip(observedChar, map(float, emission[n]))) for n, state in enumerate(states)}
+    return newTransition, newEmission
+
+
+def countsToParameters(transitionCounts, emissionCounts, states, observedChar):
+    '''Normalises expected counts to transition and emission dicts, a row with no counts is left at 0.
+    Returns:
+        the new transition and emission dicts'''
+    return parameterDicts(*normalizeCounts(transitionCounts, emissionCounts), states, observedChar)
+
+
+
+class BaumWelchTraining(object):
+    ''' Runs BaumWelch iterations until the log-likelihood stops improving.
+    Attributes:
+        observation - observed sequence
+        transition - initial transition
+        emission - initial emission
+        states - states
+        observedChar - observed characters
+        tolerance - stop once an iteration improves log Pr(x) by less than this (default None, run maxIter iterations)
+        maxIter - maximum number of iterations (default 100)
+        history - one dict per iteration with the log-likelihood of the parameters going in and the seconds it took
+    Methodes:
+        train - runs the iterations and returns the learned transition and emission
+    '''
+
+    def __init__(self, observation, transition, emission, states, observedChar, tolerance=None, maxIter=100):
+        self.observation = observation
+        self.transition = transition
+        self.emission = emission
+        self.states = states
+        self.observedChar = observedChar
+        self.tolerance = tolerance
+        self.maxIter = maxIter
+        self.history = []
+
+    def train(self):
+        '''Runs BaumWelch until convergence or maxIter, the forward, backward and
+        responsibility buffers are allocated once and reused by every iteration.
+        The observation is encoded once and the parameters stay arrays between iterations,
+        they are only converted to dicts at the end.
+        Returns:
+            the learned transition and emission dicts'''
+        if not self.observation:
+            raise ValueError('the observation is empty')
+        numChars, numStates = len(self.observation), len(self.states)
+        forward, backward = np.empty((numChars, numStates)), np.empty((numChars, numStates))
+        scale = np.empty(numChars)
+        weighted, nodeRes = np.empty((numChars - 1, numStates)), np.empty((numChars, numStates))
+        V = SoftDecoding(observation = self.observation, transition = self.transition, emission = self.emission, states = self.states, observedChar = self.observedChar)
+        transition, emission = V.modelArrays()
+        observation = V.encodeObservation()
+        self.history = []
+        for iteration in range(self.maxIter):
+            start = time.perf_counter()
+            model = (transition, emission, observation)
+            forward, backward, scale, logLikelihood = V.scaledForwardBackward(forward, backward, scale, model)
+            er = BaumWelch(forwardMatrix = forward, backwardMatrix = backward, states = self.states, observation = self.observation, transition = None, emission = None, nodeRes = None, observedChar = self.observedChar, scale = scale, model = model)
+            transition, emission = normalizeCounts(*er.expectedCounts(weighted, nodeRes))
+            self.history.append({'iteration': iteration + 1, 'logLikelihood': float(logLikelihood), 'seconds': time.perf_counter() - start})
+            if self.tolerance is not None and len(self.history) > 1 and logLikelihood - self.history[-2]['logLikelihood'] < self.tolerance:
+                break
+        self.transition, self.emission = parameterDicts(transition, emission, self.states, self.observedChar)
+        return self.transition, self.emission
+
+
+
+class BaumWelchBatch(object):
+    ''' Baum-Welch over a collection of independent observations, the expected counts of every
+    observation are summed before a single maximisation step. The E-step runs in a process pool.
+    Attributes:
+        observations - list of observed sequences
+        transition - initial transition
+        emission - initial emission
+        states - states
+        observedChar - observed characters
+        tolerance - stop once an iteration improves the total log-likelihood by less than this (default None, run maxIter iterations)
+        maxIter - maximum number of iterations (default 100)
+        workers - number of processes for the E-step (default 1, no pool)
+        batchLength - about this many symbols per batch (default 1<<16), the split does not depend on workers
+                      and the batch counts are summed in batch order, so every workers value gives the same result
+        history - one dict per iteration with the total log-likelihood and the seconds it took
+    Methodes:
+        batches - splits the observations into batches of about batchLength symbols
+        expectedCounts - the summed expected counts of the observations
+        train - runs the iterations and returns the learned transition and emission
+    '''
+
+    def __init__(self, observations, transition, emission, states, observedChar, tolerance=None, maxIter=100, workers=1, batchLength=1 << 16):
+        self.observations = [observation for observation in observations if observation] # an empty read has no counts
+        if not self.observations:
+            raise ValueError('there is no non-empty observation to train on')
+        self.transition = transition
+        self.emission = emission
+        self.states = states
+        self.observedChar = observedChar
+        self.tolerance = tolerance
+        self.maxIter = maxIter
+        self.workers = workers
+        self.batchLength = batchLength
+        self.history = []
+
+    def batches(self):
+        '''Splits the observations into contiguous batches of about equal total length.
+        Returns:
+            a list of (start, end) index ranges into observations'''
+        ends = np.cumsum([len(observation) for observation in self.observations])
+        numBatches = min(len(self.observations), max(1, -(-int(ends[-1]) // self.batchLength)))
+        bounds = np.searchsorted(ends, ends[-1] * np.arange(1, numBatches) / numBatches, side='right')
+        bounds = np.unique(np.concatenate(([0], bounds, [len(self.observations)])))
+        return list(zip(bounds[:-1].tolist(), bounds[1:].tolist()))
+
+    def expectedCounts(self, transition, emission, batches, pool=None):
+        '''The expected counts summed over all observations.
+        Returns:
+            transition counts, emission counts, total log-likelihood'''
+        tasks = [(start, end, transition, emission) for start, end in batches]
+        if pool is not None:
+            results = pool.map(batchWorkerCounts, tasks)
+        else:
+            results = [batchCounts(self, task) for task in tasks]
+        # map keeps the batch order, so the sums are added in the same order for any pool size
+        transitionCounts = sum(result[0] for result in results)
+        emissionCounts = sum(result[1] for result in results)
+        return transitionCounts, emissionCounts, sum(result[2] for result in results)
+
+    def train(self):
+        '''Runs batched BaumWelch until convergence or maxIter.
+        Returns:
+            the learned transition and emission dicts'''
+        transition, emission = self.transition, self.emission
+        batches = self.batches()
+        self.history = []
+        pool = multiprocessing.Pool(self.workers, initializer=setWorkerBatch, initargs=(self,)) if self.workers > 1 else None
+        try:
+            for iteration in range(self.maxIter):
+                start = time.perf_counter()
+                transitionCounts, emissionCounts, logLikelihood = self.expectedCounts(transition, emission, batches, pool)
+                transition, emission = countsToParameters(transitionCounts, emissionCounts, self.states, self.observedChar)
+                self.history.append({'iteration': iteration + 1, 'logLikelihood': float(logLikelihood), 'seconds': time.perf_counter() - start})
+                if self.tolerance is not None and len(self.history) > 1 and logLikelihood - self.history[-2]['logLikelihood'] < self.tolerance:
+                    break
+        finally:
+            if pool is not None:
+                pool.close()
+                pool.join()
+        self.transition, self.emission = transition, emission
+        return transition, emission
 
 
-        newEmission = {state : {} for state in self.states} # the new emission , dict of dict structure
+workerBatch = None
 
-        for key in newEmission.keys(): # assigning 0 to the new emission states
-            newEmission[key] = {state : 0 for state in self.observedChar}
 
-        for i in self.observedChar:
-            indices = self.find(self.observation, i) # gives the index
+def setWorkerBatch(batch):
+    '''Stores the batch trainer and its observations in a new worker process. In each iteration a task is then
+    a (start, end) batch range plus the current parameters.'''
+    global workerBatch
+    workerBatch = batch
 
-            for n, m in enumerate(self.states):
-                newEmission[m][i] += sum(np.asanyarray(self.nodeRes)[indices][:,n])
 
-       # make the probability
-        for k,v in newEmission.items():
-            s = sum(list(v.values()))
-            for i,j in v.items():
-                newEmission[k][i] = j/s
+def batchWorkerCounts(task):
+    '''Computes the expected counts of a batch in a worker process.'''
+    return batchCounts(workerBatch, task)
 
 
-        return newTransition, newEmission
+def batchCounts(batch, task):
+    '''The expected counts of the observations batch.observations[start:end] under one model.
+    Returns:
+        transition counts, emission counts, log-likelihood summed over the batch'''
+    start, end, transition, emission = task
+    transitionArray, emissionArray = SoftDecoding(observation = '', transition = transition, emission = emission, states = batch.states, observedChar = batch.observedChar).modelArrays()
+    numStates = len(batch.states)
+    transitionCounts = np.zeros((numStates, numStates))
+    emissionCounts = np.zeros((numStates, len(batch.observedChar)))
+    logLikelihood = 0.0
+    for observation in batch.observations[start:end]:
+        V = SoftDecoding(observation = observation, transition = transition, emission = emission, states = batch.states, observedChar = batch.observedChar)
+        model = (transitionArray, emissionArray, V.encodeObservation()) # the dicts are converted once per batch
+        forward, backward, scale, sequenceLikelihood = V.scaledForwardBackward(model = model)
+        er = BaumWelch(forwardMatrix = forward, backwardMatrix = backward, states = batch.states, observation = observation, transition = transition, emission = emission, nodeRes = None, observedChar = batch.observedChar, scale = scale, model = model)
+        sequenceTransition, sequenceEmission = er.expectedCounts()
+        transitionCounts += sequenceTransition
+        emissionCounts += sequenceEmission
+        logLikelihood += sequenceLikelihood
+    return transitionCounts, emissionCounts, logLikelihood
 
 
 
 def main():
     '''Process the input file, create an object of the class, and create the output'''
+    parser = argparse.ArgumentParser(description="Baum-Welch learning, Rosalind input on STDIN")
+    parser.add_argument('-tol', '--tolerance', type=float, default=None, help='stop once an iteration improves the log-likelihood by less than this')
+    parser.add_argument('-log', '--log', action='store_true', help='write the log-likelihood and time of each iteration to STDERR')
+    parser.add_argument('-i', '--inputFile', default=None, help='fasta of observations to train on together instead of the Rosalind observation')
+    parser.add_argument('-w', '--workers', type=int, default=1, help='number of processes for the E-step of --inputFile')
+    args = parser.parse_args()
     # pre-processing Rosalind input
     reading = sys.stdin.readlines()
     itteration = reading[0].strip()
@@ -138,7 +331,7 @@ def main():
     if transition[-1] == []: # there is a space in your input file, which I pop it out here
         transition.pop # there is a space in your input file, which I pop it out here
     transition = np.asanyarray(transition)
-    transition = transition.astype(np.float)
+    transition = transition.astype(float)
 
     emission = []
     for i in reading[11 + len(states):11 + 2*len(states)]:
@@ -146,7 +339,7 @@ def main():
     if emission[-1] == []: # there is a space in your input file, which I pop it out here
         emission.pop # there is a space in your input file, which I pop it out here
     emission = np.asanyarray(emission)
-    emission = emission.astype(np.float)
+    emission = emission.astype(float)
 
     initTransition = {}
     for i,j in enumerate(states):
@@ -167,12 +360,15 @@ def main():
                 initEmission[j][n] = emission[i][k]
 
 
-    for i in range(int(itteration)):
-        V = SoftDecoding(observation = observation, transition =initTransition, emission = initEmission, states = states  , observedChar =  observedChar)
-        forward, backward= V.forwardBackward()
-        nodeRes = V.softDecoding()
-        er = BaumWelch(forwardMatrix = forward, backwardMatrix = backward, states = states, observation= observation, transition = initTransition, emission = initEmission, nodeRes = nodeRes, observedChar = observedChar)
-        initTransition, initEmission = er.redefineParameters()
+    if args.inputFile is not None:
+        observations = [sequence for name, sequence in FastAreader(args.inputFile).readFasta()]
+        training = BaumWelchBatch(observations = observations, transition = initTransition, emission = initEmission, states = states, observedChar = observedChar, tolerance = args.tolerance, maxIter = int(itteration), workers = args.workers)
+    else:
+        training = BaumWelchTraining(observation = observation, transition = initTransition, emission = initEmission, states = states, observedChar = observedChar, tolerance = args.tolerance, maxIter = int(itteration))
+    initTransition, initEmission = training.train()
+    if args.log:
+        for record in training.history:
+            sys.stderr.write('%d\t%.6f\t%.4fs\n' % (record['iteration'], record['logLikelihood'], record['seconds']))
 
     sys.stdout.write('\t' + '\t'.join(map(str, states)) + "\n")
     for key in states:
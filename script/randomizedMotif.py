@@ -0,0 +1,191 @@
+import sys
+import argparse
+import multiprocessing
+import numpy as np
+from fastaReader import FastAreader
+from missingMotif import KmerCounter
+
+
+class RandomizedMotifSearch(object):
+    '''Returns a RandomizedMotifSearch object that finds a motif shared by a collection of sequences.
+
+    Attributes:
+        sequences -- list of sequences (ATCG)
+        motifLen -- the length of the motif
+        restarts -- number of random restarts (default 1000)
+        pseudocount -- pseudocount added to every profile cell (default 1)
+        workers -- number of processes running restarts (default 1)
+        seed -- base seed, restart i always uses the seed (seed, i) (default 0)
+    Methods:
+        encodeMatrix -- encodes the sequences into one padded matrix
+        motifMatrix -- gathers the motifs at a set of positions
+        countMatrix -- counts the bases of each motif column
+        profile -- builds the profile of a set of motif positions
+        score -- scores a set of motif positions
+        mostProbable -- finds the most probable window of every sequence under a profile
+        search -- runs one restart
+        searchRestarts -- runs a batch of restarts and keeps the best
+        run -- runs every restart and returns the best motifs
+    '''
+    def __init__(self, sequences, motifLen, restarts=1000, pseudocount=1, workers=1, seed=0):
+        '''RandomizedMotifSearch constructor, encodes the sequences once.
+        '''
+        self.sequences = sequences
+        self.motifLen = motifLen
+        self.restarts = restarts
+        self.pseudocount = pseudocount
+        self.workers = workers
+        self.seed = seed
+        self.encoded = self.encodeMatrix()
+        # number of windows of each sequence, random positions are drawn below it
+        self.numWindows = np.array([len(sequence) - self.motifLen + 1 for sequence in self.sequences])
+        if (self.numWindows < 1).any():
+            raise ValueError('every sequence must be at least motifLen long')
+
+    def encodeMatrix(self):
+        '''Encodes the sequences into a matrix, shorter sequences and non ATCG characters are coded 4.
+
+        Returns:
+            an int8 matrix of shape (number of sequences, longest sequence)
+        '''
+        longest = max(len(sequence) for sequence in self.sequences)
+        encoded = np.full((len(self.sequences), longest), 4, dtype=np.int8)
+        for row, sequence in enumerate(self.sequences):
+            codes = KmerCounter.encode(sequence)
+            encoded[row, :len(codes)] = np.where(codes >= 0, codes, 4)
+        return encoded
+
+    def motifMatrix(self, positions):
+        '''Gathers the motifs that start at positions.
+
+        Returns:
+            an int8 matrix of shape (number of sequences, motifLen)
+        '''
+        columns = positions[:, None] + np.arange(self.motifLen)
+        return np.take_along_axis(self.encoded, columns, axis=1)
+
+    def countMatrix(self, positions):
+        '''Counts the bases of each column of the motifs starting at positions.
+
+        Returns:
+            a (motifLen, 5) count matrix, the last column counts padding bases
+        '''
+        cells = np.arange(self.motifLen) * 5 + self.motifMatrix(positions)  # one bin per (column, base)
+        return np.bincount(cells.ravel(), minlength=self.motifLen * 5).reshape(self.motifLen, 5)
+
+    def profile(self, positions):
+        '''Builds a profile with pseudocounts from the motifs starting at positions.
+
+        Returns:
+            a (motifLen, 4) matrix of base probabilities
+        '''
+        counts = self.countMatrix(positions)[:, :4] + self.pseudocount
+        return counts / counts.sum(axis=1, keepdims=True)
+
+    def score(self, positions):
+        '''Scores the motifs starting at positions, the number of bases that differ from the consensus.
+
+        Returns:
+            the score, lower is better
+        '''
+        counts = self.countMatrix(positions)[:, :4]
+        return int(len(self.sequences) * self.motifLen - counts.max(axis=1).sum())
+
+    def mostProbable(self, profile):
+        '''Finds the profile most probable window of every sequence.
+
+        Every window is scored at once: the log-probability of each base under each profile column
+        is looked up on the whole encoded matrix and the shifted lookups are summed.
+        Returns:
+            an array with the start of the most probable window of each sequence, ties go to the first window
+        '''
+        numWindows = self.encoded.shape[1] - self.motifLen + 1
+        with np.errstate(divide='ignore'):
+            logProfile = np.log(np.hstack((profile, np.zeros((self.motifLen, 1)))))  # padding base has probability 0
+        windowScore = np.zeros((len(self.sequences), numWindows))
+        for column in range(self.motifLen):
+            windowScore += logProfile[column][self.encoded[:, column:column + numWindows]]
+        return windowScore.argmax(axis=1)
+
+    def search(self, restart):
+        '''Runs one restart of randomized motif search.
+
+        Arguments:
+            restart -- the restart number, it seeds the random start
+        Returns:
+            (score, positions) of the best motifs of this restart
+        '''
+        rng = np.random.default_rng([self.seed, restart])
+        bestPositions = (rng.random(len(self.sequences)) * self.numWindows).astype(np.int64)
+        bestScore = self.score(bestPositions)
+        while True:  # stop as soon as the profile no longer improves the motifs
+            positions = self.mostProbable(self.profile(bestPositions))
+            score = self.score(positions)
+            if score >= bestScore:
+                return bestScore, bestPositions
+            bestScore = score
+            bestPositions = positions
+
+    def searchRestarts(self, restartRange):
+        '''Runs a batch of restarts.
+
+        Returns:
+            (score, restart, positions) of the best restart in the batch
+        '''
+        best = None
+        for restart in restartRange:
+            score, positions = self.search(restart)
+            if best is None or score < best[0]:
+                best = (score, restart, positions)
+        return best
+
+    def run(self):
+        '''Runs every restart, in a process pool when workers > 1.
+
+        The result only depends on seed, the lowest restart number wins a tie.
+        Returns:
+            (score, list of best motifs)
+        '''
+        batchSize = max(1, self.restarts // (self.workers * 4))
+        batches = [range(start, min(start + batchSize, self.restarts)) for start in range(0, self.restarts, batchSize)]
+        if self.workers > 1:
+            with multiprocessing.Pool(self.workers, initializer=setWorkerEngine, initargs=(self,)) as pool:
+                results = pool.map(searchWorkerRestarts, batches)
+        else:
+            results = [self.searchRestarts(batch) for batch in batches]
+        score, restart, positions = min(results, key=lambda result: (result[0], result[1]))
+        motifs = [sequence[start:start + self.motifLen] for sequence, start in zip(self.sequences, positions.tolist())]
+        return score, motifs
+
+
+workerEngine = None  # the engine of a worker process, set once by the pool initializer
+
+
+def setWorkerEngine(engine):
+    '''Stores the search engine in a new worker process. Each task is then only a range of restart numbers,
+    and the worker reads the sequences from its copy of the engine.'''
+    global workerEngine
+    workerEngine = engine
+
+
+def searchWorkerRestarts(restartRange):
+    '''Runs a batch of restarts in a worker process.'''
+    return workerEngine.searchRestarts(restartRange)
+
+
+def main():
+    '''Reads a fasta from STDIN, runs RandomizedMotifSearch and writes the best motifs to STDOUT'''
+    parser = argparse.ArgumentParser(description="randomized motif search")
+    parser.add_argument('-k', '--motifLen', type=int, required=True, help='the motif length')
+    parser.add_argument('-r', '--restarts', type=int, default=1000, help='the number of random restarts')
+    parser.add_argument('-p', '--pseudocount', type=float, default=1, help='the profile pseudocount')
+    parser.add_argument('-w', '--workers', type=int, default=1, help='number of processes running restarts')
+    parser.add_argument('-s', '--seed', type=int, default=0, help='the random seed')
+    args = parser.parse_args()
+    sequences = [fastaSeq[1] for fastaSeq in FastAreader('').readFasta()]
+    m = RandomizedMotifSearch(sequences, args.motifLen, args.restarts, args.pseudocount, args.workers, args.seed)
+    score, motifs = m.run()
+    sys.stdout.write('\n'.join(motifs) + '\n')
+
+if __name__ == "__main__":
+    main()